@@ -1,13 +1,20 @@
 ## imports
+import os
 import socket
-from datetime import *
-import struct
+import sys
 import time
 
+# The packet format is shared with the GUI
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "GUI"))
+from codec import PacketLengthError, decode
+from framing import FrameDecoder
+from packet_log import PacketLogger, setup_logging
+
 ## constants
 BUFFER_SIZE = 2**12
 HOST = "127.0.0.1"
 PORT = 8080
+LOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "gui_emulator.jsonl")
 
 
 ## main
@@ -21,30 +28,22 @@ if __name__ == "__main__":
     serverSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     serverSocket.connect((HOST, PORT))               
 
+    # log packets on a background thread
+    setup_logging(LOG_PATH)
+    packetLogger = PacketLogger()
+
     # get data
+    frameDecoder = FrameDecoder()
     while (True):
-        try:
-            received_data = serverSocket.recv(BUFFER_SIZE)
-            received_data = received_data[4:]
-
-            radioID = int.from_bytes(received_data[0:2])
-            panicState = int(received_data[2]) < 0
-            messageID = int(received_data[2] & 0b0111111)
-            gpsLat = struct.unpack('>f', received_data[3:7])[0]
-            gpsLong = struct.unpack('>f', received_data[7:11])[0]
-            batteryLife = int(received_data[11])
-            utc = int.from_bytes(received_data[12:16], signed=False)
-
-            ackSocket.send(received_data[0:3])
-
-            print("Radio ID:", radioID)
-            print("Panic State:", panicState)
-            print("Message ID:", messageID)
-            print("GPS Latitude:", gpsLat)
-            print("GPS Longitude:", gpsLong)
-            print("Battery Life:", batteryLife)
-            print("Timestamp:", utc)
-        except:
-            print("Error Decoding")
-        finally:
-            print("\n")
\ No newline at end of file
+        received_data = serverSocket.recv(BUFFER_SIZE)
+        if not received_data:
+            print("Connection closed")
+            break
+        # One recv can hold several packets or only part of one
+        for packet in frameDecoder.frames(received_data):
+            try:
+                point = decode(packet)
+                ackSocket.send(packet[0:3])
+                packetLogger.log_packet(point)
+            except PacketLengthError:
+                print("Error Decoding")
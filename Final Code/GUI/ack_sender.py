@@ -0,0 +1,117 @@
+"""
+This file contains the code for sending acknowledgements back to GNU Radio on
+a separate thread so receiving packets never waits on the transmit side.
+"""
+
+import sys
+import threading
+import time
+
+from lanes import LaneQueue
+from metrics import metrics
+
+# Most routine acknowledgements that can wait to be sent before the oldest are
+# dropped (panic acknowledgements are never dropped)
+ACK_QUEUE_SIZE = 256
+# Seconds during which a repeated acknowledgement is not sent again
+ACK_DEDUP_WINDOW = 5.0
+
+
+class AckSender:
+    def __init__(
+        self,
+        send,
+        on_error=None,
+        max_queue=ACK_QUEUE_SIZE,
+        dedup_window=ACK_DEDUP_WINDOW,
+    ):
+        """
+        Creates an AckSender which sends acknowledgements by calling send
+        with the bytes from its own thread
+
+        on_error is called with the OSError if sending fails
+        """
+        self.send_bytes = send
+        self.on_error = on_error
+        self.dedup_window = dedup_window
+        # Acknowledgements waiting to be sent with the time they were queued,
+        # panic acknowledgements first
+        self.queue = LaneQueue(max_queue)
+        # Time each (radio id, message id) was last queued, oldest first
+        self.recent = {}
+        # Counters for monitoring the sender
+        self.sent = 0
+        self.dropped = 0
+        self.duplicates = 0
+        self.batches = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+        # Starts a separate thread that sends the acknowledgements
+        threading.Thread(target=self.exec, daemon=True).start()
+
+    def send(self, ack):
+        """
+        Queues an acknowledgement without blocking
+
+        ack is the first 3 bytes of the packet (radio id and message byte)
+        Returns False if the acknowledgement was a duplicate
+        """
+        now = time.monotonic()
+        # The panic bit is not part of the message id
+        key = (ack[0], ack[1], ack[2] & 0b1111111)
+        # Forget acknowledgements older than the window
+        while self.recent:
+            oldest = next(iter(self.recent))
+            if now - self.recent[oldest] < self.dedup_window:
+                break
+            del self.recent[oldest]
+        if key in self.recent:
+            self.duplicates += 1
+            return False
+        self.recent[key] = now
+        # Copy the bytes since the packet buffer can be reused
+        if not self.queue.put((bytes(ack), now), panic=ack[2] & 0b10000000):
+            # The oldest routine acknowledgement was dropped to make room
+            self.dropped += 1
+        return True
+
+    def exec(self):
+        """
+        Main exec loop for the sender
+        Runs in a separate thread
+        """
+        try:
+            while True:
+                # Wait for an acknowledgement, then send everything that is waiting at once
+                batch = self.queue.get_batch()
+                self.send_bytes(b"".join(ack for ack, _ in batch))
+                # Update the counters
+                now = time.monotonic()
+                for _, queued in batch:
+                    self.last_latency = now - queued
+                    self.max_latency = max(self.max_latency, self.last_latency)
+                    self.total_latency += self.last_latency
+                    metrics.observe_duration("ack", self.last_latency)
+                self.sent += len(batch)
+                self.batches += 1
+        except OSError as err:
+            # Print out any error with sending data
+            print(f"Error sending acknowledgement to GNURadio: {err}", file=sys.stderr)
+            if self.on_error:
+                self.on_error(err)
+
+    def stats(self):
+        """
+        Returns the counters for the sender
+        """
+        return {
+            "queue_depth": len(self.queue),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "duplicates": self.duplicates,
+            "batches": self.batches,
+            "last_latency": self.last_latency,
+            "max_latency": self.max_latency,
+            "average_latency": self.total_latency / self.sent if self.sent else 0.0,
+        }
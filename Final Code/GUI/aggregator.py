@@ -0,0 +1,240 @@
+"""
+This file contains the code for receiving packets from several base stations
+at once and merging them into one stream. A packet heard by more than one
+base station is only passed on and acknowledged once.
+
+Every connection runs on one asyncio event loop, so dozens of base stations
+don't need dozens of threads.
+"""
+
+import asyncio
+from collections import OrderedDict
+import heapq
+import sys
+import threading
+import time
+from typing import NamedTuple
+
+from ack_sender import AckSender
+from beacons import BeaconTable
+from codec import PacketLengthError, decode
+from dedup import DUPLICATE_MAX_ENTRIES, DUPLICATE_WINDOW, DuplicateIndex, packet_key
+from framing import FrameDecoder
+from metrics import metrics
+from network import NetworkCore
+from packet_store import PacketStore
+
+# Seconds a packet is held so copies from other base stations can be matched
+# and packets can be put in time order
+REORDER_DELAY = 0.5
+
+
+class Receiver(NamedTuple):
+    """
+    A base station running the GNU Radio flowgraph
+    """
+
+    name: str
+    recv_addr: tuple
+    # None if this base station should never send acknowledgements
+    send_addr: tuple | None
+
+
+class Pending:
+    """
+    A packet waiting to be passed on
+    """
+
+    __slots__ = ("received_at", "packet", "point", "heard_by", "acked")
+
+    def __init__(self, received_at, packet, point, name):
+        self.received_at = received_at
+        self.packet = packet
+        self.point = point
+        # Names of the base stations that heard the packet, first one first
+        self.heard_by = [name]
+        # Whether a base station has acknowledged the packet
+        self.acked = False
+
+
+class Aggregator:
+    def __init__(self, receivers, store_path=None, on_status=None, delay=REORDER_DELAY):
+        """
+        Creates an Aggregator which receives packets from every receiver
+
+        Packets are saved to the database at store_path unless it is None.
+        on_status is called with the name of a receiver and True or False when
+        its connection comes up or goes down.
+        """
+        self.delay = delay
+        self.loop = asyncio.new_event_loop()
+        self.networks = {}
+        for receiver in receivers:
+            # Each receiver needs its own buffer since frames can be split across reads
+            frameDecoder = FrameDecoder()
+            self.networks[receiver.name] = NetworkCore(
+                receiver.recv_addr,
+                receiver.send_addr,
+                on_data=self.make_receive(receiver.name, frameDecoder),
+                on_status=(lambda connected, name=receiver.name: on_status(name, connected))
+                if on_status
+                else None,
+                on_disconnect=frameDecoder.reset,
+                loop=self.loop,
+            )
+        # Each base station that can send acknowledgements gets its own
+        # sender, so a base station that is down only holds up its own
+        self.ackSenders = {
+            receiver.name: AckSender(self.networks[receiver.name].send)
+            for receiver in receivers
+            if receiver.send_addr is not None
+        }
+        # Keys of packets passed on without an acknowledgement, with the time
+        # they were received, oldest first
+        self.unacked = OrderedDict()
+        # Packets that have already been passed on
+        self.duplicateIndex = DuplicateIndex()
+        # Packets waiting to be passed on by key
+        self.pending = {}
+        # Keys of the waiting packets ordered by (unix time, arrival)
+        self.heap = []
+        self.sequence = 0
+        # Saves every packet so it is kept after the program is closed
+        self.packetStore = PacketStore(store_path) if store_path else None
+        # Keeps the state of every beacon and notices when one stops reporting
+        self.beaconTable = BeaconTable()
+        # Functions called with every new packet
+        self.subscribers = []
+        # Copies heard after the packet was passed on
+        self.late_duplicates = 0
+        if self.packetStore:
+            metrics.gauge("store_queue_depth", lambda: len(self.packetStore.queue))
+            metrics.gauge("store_dropped", lambda: self.packetStore.dropped)
+        metrics.gauge("reorder_queue_depth", lambda: len(self.heap))
+        metrics.gauge(
+            "ack_queue_depth", lambda: sum(len(sender.queue) for sender in self.ackSenders.values())
+        )
+        metrics.gauge(
+            "ack_dropped", lambda: sum(sender.dropped for sender in self.ackSenders.values())
+        )
+
+    def subscribe(self, callback):
+        """
+        Calls callback with the packet bytes, the decoded point and the names
+        of the receivers that heard it for every new packet. It is called on the
+        event loop thread so it must not block.
+        """
+        self.subscribers.append(callback)
+
+    def start(self):
+        """
+        Starts the event loop thread and connects to every receiver
+        """
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        for network in self.networks.values():
+            network.start()
+        asyncio.run_coroutine_threadsafe(self.release_loop(), self.loop)
+        self.loop.call_soon_threadsafe(self.beaconTable.run, self.loop)
+
+    def make_receive(self, name, frameDecoder):
+        """
+        Returns the function that handles data from one receiver
+        """
+
+        def receive(data):
+            # One read can hold several packets or only part of one
+            for packet in frameDecoder.frames(data):
+                metrics.count("packets")
+                try:
+                    self.packet_received(name, packet, decode(packet))
+                except PacketLengthError as err:
+                    metrics.count("length_errors")
+                    # Print out any error with packet length
+                    print(f"Error from {name}: {err}", file=sys.stderr)
+
+        return receive
+
+    def packet_received(self, name, packet, point):
+        """
+        Handles a packet heard by one receiver
+        """
+        key = packet_key(packet)
+        if (pending := self.pending.get(key)) is not None:
+            # Another receiver already heard this packet
+            if name not in pending.heard_by:
+                pending.heard_by.append(name)
+            # Acknowledge it if the receivers before could not
+            if not pending.acked:
+                pending.acked = self.acknowledge(name, packet)
+            metrics.count("duplicates")
+            return
+        if self.duplicateIndex.seen(packet):
+            # The packet was already passed on, acknowledge it if nobody did
+            if key in self.unacked and self.acknowledge(name, packet):
+                del self.unacked[key]
+            self.late_duplicates += 1
+            metrics.count("duplicates")
+            return
+        pending = Pending(time.monotonic(), bytes(packet), point, name)
+        # The first receiver that can acknowledge the packet does, so the PLB
+        # is only acknowledged once
+        pending.acked = self.acknowledge(name, packet)
+        if point.panic_state:
+            # Panic packets are passed on right away
+            self.publish(pending)
+            return
+        self.pending[key] = pending
+        self.sequence += 1
+        unix_time = key[2]
+        heapq.heappush(self.heap, (unix_time, self.sequence, key))
+
+    def acknowledge(self, name, packet):
+        """
+        Queues the acknowledgement of a packet on the sender of a receiver
+        Returns False if the receiver can't send acknowledgements or its send
+        connection is down, so another receiver that heard it can
+        """
+        if (ackSender := self.ackSenders.get(name)) is None:
+            return False
+        if not self.networks[name].send_ready.is_set():
+            # Sending would wait until the connection is back
+            return False
+        ackSender.send(packet[:3])
+        return True
+
+    async def release_loop(self):
+        """
+        Passes on waiting packets once they have been held for the delay
+        """
+        while True:
+            await asyncio.sleep(self.delay / 4)
+            cutoff = time.monotonic() - self.delay
+            # Packets are released in time order, so a packet can wait a
+            # little longer for one with an earlier time that arrived later
+            while self.heap and self.pending[self.heap[0][2]].received_at <= cutoff:
+                _, _, key = heapq.heappop(self.heap)
+                self.publish(self.pending.pop(key))
+
+    def publish(self, pending):
+        """
+        Saves a packet and passes it to the subscribers
+        """
+        if not pending.acked:
+            # A send connection may have come back while the packet was held
+            pending.acked = any(self.acknowledge(name, pending.packet) for name in pending.heard_by)
+        if not pending.acked:
+            # Remember the packet so a copy heard later by a receiver that can
+            # send acknowledgements is still acknowledged
+            now = time.monotonic()
+            while self.unacked and (
+                now - next(iter(self.unacked.values())) >= DUPLICATE_WINDOW
+                or len(self.unacked) >= DUPLICATE_MAX_ENTRIES
+            ):
+                self.unacked.popitem(last=False)
+            self.unacked[packet_key(pending.packet)] = pending.received_at
+        if self.packetStore:
+            self.packetStore.append(pending.packet)
+        self.beaconTable.update(pending.point)
+        heard_by = tuple(pending.heard_by)
+        for callback in self.subscribers:
+            callback(pending.packet, pending.point, heard_by)
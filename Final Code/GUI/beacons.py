@@ -0,0 +1,288 @@
+"""
+This file contains the code for keeping the state of every beacon: where and
+when it was last heard, how many of its packets were lost and how fast its
+battery is falling. Each packet updates the state of its beacon in constant
+time.
+
+Beacons that stop reporting are found with a hashed timer wheel, so checking
+for them costs nothing for the beacons that are still reporting, however many
+there are.
+"""
+
+import heapq
+import math
+import time
+
+from packet_log import logger
+
+# Seconds without a packet before a beacon is reported as stale (the PLB sends every 10 seconds)
+STALE_AFTER = 60.0
+# Seconds without a packet before contact with a beacon is reported as lost
+LOST_AFTER = 300.0
+# Seconds between ticks of the timer wheel
+TIMER_TICK = 1.0
+# Number of slots in the timer wheel, deadlines further away wrap around
+TIMER_SLOTS = 512
+# Seconds over which old battery readings fade out of the battery slope
+BATTERY_SLOPE_WINDOW = 3600.0
+# Message ids count up to this and start again at 0 (the panic bit is not part of the id)
+MESSAGE_ID_MODULUS = 128
+
+
+class BeaconState:
+    """
+    Everything known about one beacon
+    """
+
+    __slots__ = (
+        "radio_id",
+        "latest",
+        "last_seen",
+        "panic_state",
+        "received",
+        "expected",
+        "status",
+        "deadline",
+        "slot",
+        "battery_start",
+        "battery_time",
+        "battery_sums",
+    )
+
+    def __init__(self, radio_id):
+        self.radio_id = radio_id
+        # Latest Packet and the monotonic time it was received
+        self.latest = None
+        self.last_seen = 0.0
+        self.panic_state = False
+        # Packets received and packets sent according to the message ids
+        self.received = 0
+        self.expected = 0
+        # "ok", "stale" or "lost"
+        self.status = "ok"
+        # Tick of the timer wheel when the status changes next and its slot
+        self.deadline = 0
+        self.slot = None
+        # Unix time of the first battery reading, readings are relative to it
+        self.battery_start = None
+        self.battery_time = 0.0
+        # Weight, time, time squared, battery and time times battery, summed
+        # with older readings weighted less
+        self.battery_sums = [0.0, 0.0, 0.0, 0.0, 0.0]
+
+    def update(self, packet, now):
+        """
+        Updates the state with a new packet received at the monotonic time now
+        """
+        if self.latest is None:
+            self.expected = 1
+        else:
+            # Message ids that were skipped are packets that never arrived
+            gap = (packet.message_id - self.latest.message_id) % MESSAGE_ID_MODULUS
+            # A gap of 0 is a copy of the last packet, which was already counted
+            self.expected += gap
+            if gap == 0:
+                self.received -= 1
+        self.received += 1
+        self.latest = packet
+        self.last_seen = now
+        self.panic_state = packet.panic_state
+        self.add_battery(packet.unix_time, packet.battery_life)
+
+    def add_battery(self, unix_time, battery_life):
+        """
+        Adds a battery reading to the least squares fit of the battery slope
+        Older readings are faded out so the slope follows recent changes
+        """
+        if self.battery_start is None:
+            self.battery_start = unix_time
+        t = unix_time - self.battery_start
+        sums = self.battery_sums
+        if t > self.battery_time:
+            decay = math.exp((self.battery_time - t) / BATTERY_SLOPE_WINDOW)
+            for i in range(5):
+                sums[i] *= decay
+            self.battery_time = t
+        sums[0] += 1
+        sums[1] += t
+        sums[2] += t * t
+        sums[3] += battery_life
+        sums[4] += t * battery_life
+
+    @property
+    def battery_slope(self):
+        """
+        Change in battery life in percent per hour, or 0 if it can't be told yet
+        """
+        weight, t, t2, battery, t_battery = self.battery_sums
+        denominator = weight * t2 - t * t
+        if denominator <= 1e-9 * max(weight * t2, 1):
+            return 0.0
+        return (weight * t_battery - t * battery) / denominator * 3600
+
+    @property
+    def loss(self):
+        """
+        Fraction of the packets sent by the beacon that were not received
+        """
+        return 1 - self.received / self.expected if self.expected else 0.0
+
+
+class BeaconTable:
+    def __init__(
+        self,
+        stale_after=STALE_AFTER,
+        lost_after=LOST_AFTER,
+        tick=TIMER_TICK,
+        slots=TIMER_SLOTS,
+    ):
+        """
+        Creates a BeaconTable which keeps the state of every beacon and calls
+        its subscribers when a beacon goes stale, is lost or is heard again
+        """
+        self.stale_after = stale_after
+        self.lost_after = lost_after
+        self.tick = tick
+        self.beacons = {}
+        # Number of beacons with each status, kept up to date so reading them
+        # from another thread never walks the table
+        self.counts = {"ok": 0, "stale": 0, "lost": 0}
+        # Radio ids of the beacons whose status changes in each tick, by tick modulo the slots
+        self.wheel = [set() for _ in range(slots)]
+        # Last tick that was processed
+        self.current = math.floor(time.monotonic() / tick)
+        # Functions called with every alert
+        self.subscribers = []
+
+    def subscribe(self, callback):
+        """
+        Calls callback with "stale", "lost" or "recovered" and the BeaconState
+        when a beacon stops or starts reporting again
+        """
+        self.subscribers.append(callback)
+
+    def update(self, packet, now=None):
+        """
+        Updates the state of the beacon that sent a decoded Packet
+        Returns the BeaconState
+        """
+        if now is None:
+            now = time.monotonic()
+        if (state := self.beacons.get(packet.radio_id)) is None:
+            state = self.beacons[packet.radio_id] = BeaconState(packet.radio_id)
+            self.counts["ok"] += 1
+        state.update(packet, now)
+        if state.status != "ok":
+            self.set_status(state, "ok")
+            self.alert("recovered", state)
+        self.schedule(state, now + self.stale_after)
+        return state
+
+    def schedule(self, state, when):
+        """
+        Moves a beacon to the slot of the timer wheel for the monotonic time when
+        """
+        if state.slot is not None:
+            state.slot.discard(state.radio_id)
+        state.deadline = math.ceil(when / self.tick)
+        state.slot = self.wheel[state.deadline % len(self.wheel)]
+        state.slot.add(state.radio_id)
+
+    def advance(self, now=None):
+        """
+        Processes every tick of the timer wheel up to the monotonic time now
+        """
+        if now is None:
+            now = time.monotonic()
+        target = math.floor(now / self.tick)
+        if target - self.current >= len(self.wheel):
+            # Every slot is due, so process each once
+            for slot in self.wheel:
+                self.expire(slot, target)
+        else:
+            for tick in range(self.current + 1, target + 1):
+                self.expire(self.wheel[tick % len(self.wheel)], tick)
+        self.current = max(self.current, target)
+
+    def expire(self, slot, tick):
+        """
+        Changes the status of the beacons in a slot whose deadline has passed
+        Beacons with a deadline a whole turn of the wheel or more away stay
+        """
+        for radio_id in [radio_id for radio_id in slot if self.beacons[radio_id].deadline <= tick]:
+            state = self.beacons[radio_id]
+            slot.discard(radio_id)
+            state.slot = None
+            if state.status == "ok":
+                self.set_status(state, "stale")
+                self.alert("stale", state)
+                self.schedule(state, state.last_seen + self.lost_after)
+            else:
+                self.set_status(state, "lost")
+                self.alert("lost", state)
+
+    def set_status(self, state, status):
+        """
+        Changes the status of a beacon and the count of each status
+        """
+        self.counts[state.status] -= 1
+        self.counts[status] += 1
+        state.status = status
+
+    def alert(self, kind, state):
+        """
+        Calls the subscribers with an alert
+        """
+        for callback in self.subscribers:
+            callback(kind, state)
+
+    def run(self, loop):
+        """
+        Advances the timer wheel every tick on the event loop loop
+        Must be called on the event loop thread, like update
+        """
+        self.advance()
+        loop.call_later(self.tick, self.run, loop)
+
+    def count(self, status):
+        """
+        Returns the number of beacons with a status
+        Can be called from any thread
+        """
+        return self.counts[status]
+
+    def fastest_draining(self, count=10):
+        """
+        Returns the beacons whose battery is falling fastest, fastest first
+        """
+        return heapq.nsmallest(count, self.beacons.values(), key=lambda state: state.battery_slope)
+
+    def __iter__(self):
+        return iter(self.beacons.values())
+
+    def __len__(self):
+        return len(self.beacons)
+
+
+def log_alert(kind, state):
+    """
+    Logs an alert, which is written to the console and the log file on the
+    logging thread
+    """
+    data = {"event": kind, "radio_id": state.radio_id}
+    if kind == "recovered":
+        logger.info("Radio %d is reporting again", state.radio_id, extra={"data": data})
+    else:
+        seconds = time.monotonic() - state.last_seen
+        data.update(
+            seconds=seconds, latitude=state.latest.latitude, longitude=state.latest.longitude
+        )
+        logger.warning(
+            "Radio %d has not reported for %.0f seconds (%s), last seen at %.4f, %.4f",
+            state.radio_id,
+            seconds,
+            kind,
+            state.latest.latitude,
+            state.latest.longitude,
+            extra={"data": data},
+        )
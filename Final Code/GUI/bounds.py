@@ -0,0 +1,176 @@
+"""
+This file contains the code for keeping track of the area covered by the
+received points so the map can be fit to them without searching every point.
+"""
+
+from array import array
+from collections import deque
+import operator
+import time
+
+
+class Bounds:
+    """
+    Smallest box holding a set of points
+    """
+
+    __slots__ = ("south", "west", "north", "east")
+
+    def __init__(self, latitude, longitude):
+        self.south = self.north = latitude
+        self.west = self.east = longitude
+
+    def extend(self, latitude, longitude):
+        """
+        Grows the box to hold the point
+        """
+        if latitude < self.south:
+            self.south = latitude
+        elif latitude > self.north:
+            self.north = latitude
+        if longitude < self.west:
+            self.west = longitude
+        elif longitude > self.east:
+            self.east = longitude
+
+    def contains(self, other):
+        """
+        Returns True if the box holds the whole of another box
+        """
+        return (
+            self.south <= other.south
+            and self.west <= other.west
+            and self.north >= other.north
+            and self.east >= other.east
+        )
+
+    def copy(self):
+        """
+        Returns a box that doesn't grow with this one
+        """
+        bounds = Bounds(self.south, self.west)
+        bounds.extend(self.north, self.east)
+        return bounds
+
+    def padded(self, padding):
+        """
+        Returns the (southwest, northeast) corners with padding added in degrees
+        """
+        return (
+            (self.south - padding, self.west - padding),
+            (self.north + padding, self.east + padding),
+        )
+
+
+class BoundsTracker:
+    def __init__(self, window=None):
+        """
+        Creates a BoundsTracker which keeps the bounds of every point, of each
+        radio, and of the points received in the last window seconds
+
+        If window is None only the running bounds are kept
+        """
+        self.window = window
+        self.total = None
+        self.radios = {}
+        # Times and positions of the points in the window
+        self.times = array("d")
+        self.latitudes = array("d")
+        self.longitudes = array("d")
+        # Index of the point at the start of the arrays, since old points are removed
+        self.base = 0
+        # Index of the oldest point in the window
+        self.first = 0
+        # Indexes of the points that can still be the extreme in the window,
+        # so the extreme is always at the front
+        self.min_latitudes = deque()
+        self.max_latitudes = deque()
+        self.min_longitudes = deque()
+        self.max_longitudes = deque()
+
+    def add(self, radio_id, latitude, longitude, now=None):
+        """
+        Adds a point to the bounds
+        """
+        if self.total is None:
+            self.total = Bounds(latitude, longitude)
+        else:
+            self.total.extend(latitude, longitude)
+        if (radio := self.radios.get(radio_id)) is None:
+            self.radios[radio_id] = Bounds(latitude, longitude)
+        else:
+            radio.extend(latitude, longitude)
+        if self.window is None:
+            return
+        now = time.monotonic() if now is None else now
+        self.expire(now)
+        index = self.base + len(self.times)
+        self.times.append(now)
+        self.latitudes.append(latitude)
+        self.longitudes.append(longitude)
+        # Points that can no longer be an extreme are removed from the back
+        for indexes, values, value, is_better in (
+            (self.min_latitudes, self.latitudes, latitude, operator.le),
+            (self.max_latitudes, self.latitudes, latitude, operator.ge),
+            (self.min_longitudes, self.longitudes, longitude, operator.le),
+            (self.max_longitudes, self.longitudes, longitude, operator.ge),
+        ):
+            while indexes and is_better(value, values[indexes[-1] - self.base]):
+                indexes.pop()
+            indexes.append(index)
+
+    def expire(self, now):
+        """
+        Removes points older than the window
+        """
+        cutoff = now - self.window
+        end = self.base + len(self.times)
+        while self.first < end and self.times[self.first - self.base] < cutoff:
+            self.first += 1
+        # Only shrink the arrays once half of them has expired so each point
+        # is moved a constant number of times on average
+        expired = self.first - self.base
+        if expired and expired >= len(self.times) // 2:
+            del self.times[:expired]
+            del self.latitudes[:expired]
+            del self.longitudes[:expired]
+            self.base = self.first
+        for indexes in (
+            self.min_latitudes,
+            self.max_latitudes,
+            self.min_longitudes,
+            self.max_longitudes,
+        ):
+            while indexes and indexes[0] < self.first:
+                indexes.popleft()
+
+    def bounds(self):
+        """
+        Returns the bounds of every point, or None if there are no points
+        """
+        return self.total
+
+    def radio_bounds(self, radio_id):
+        """
+        Returns the bounds of the points from one radio, or None if there are none
+        """
+        return self.radios.get(radio_id)
+
+    def window_bounds(self, now=None):
+        """
+        Returns the bounds of the points in the window, or None if there are none
+        """
+        if self.window is None:
+            return self.total
+        self.expire(time.monotonic() if now is None else now)
+        if self.first == self.base + len(self.times):
+            return None
+        bounds = Bounds(
+            self.latitudes[self.min_latitudes[0] - self.base],
+            self.longitudes[self.min_longitudes[0] - self.base],
+        )
+        bounds.extend(
+            self.latitudes[self.max_latitudes[0] - self.base],
+            self.longitudes[self.max_longitudes[0] - self.base],
+        )
+        return bounds
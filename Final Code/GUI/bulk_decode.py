@@ -0,0 +1,75 @@
+"""
+This file contains the code for decoding many packets at once with NumPy.
+It is meant for replaying captured traffic or loading saved history, where
+decoding one packet at a time in Python would be slow.
+"""
+
+from typing import NamedTuple
+
+import numpy as np
+
+from framing import HEADER_SIZE
+
+# Same layout as codec.PACKET_STRUCT (big endian), with the message byte
+# signed so the panic bit is the sign
+PACKET_DTYPE = np.dtype(
+    [
+        ("radio_id", ">u2"),
+        ("message_byte", "i1"),
+        ("latitude", ">f4"),
+        ("longitude", ">f4"),
+        ("battery_life", "u1"),
+        ("unix_time", ">u4"),
+    ]
+)
+# Packet with the header that GNU Radio puts in front of it
+FRAME_DTYPE = np.dtype([("header", f"V{HEADER_SIZE}"), *PACKET_DTYPE.descr])
+
+
+class DecodedPackets(NamedTuple):
+    """
+    Columns of decoded packets
+    """
+
+    # Structured array with one record per packet
+    packets: np.ndarray
+    # Message id without the panic bit
+    message_id: np.ndarray
+    # True where the panic bit is set
+    panic_state: np.ndarray
+
+
+def decode_packets(buffer, dtype=PACKET_DTYPE):
+    """
+    Decodes a buffer holding a whole number of packets
+
+    The packets array shares memory with the buffer instead of copying it
+    """
+    # Raise exception if the buffer does not hold a whole number of packets
+    if len(buffer) % dtype.itemsize:
+        raise ValueError(
+            f"Expected a multiple of {dtype.itemsize} bytes. Received {len(buffer)} bytes"
+        )
+    packets = np.frombuffer(buffer, dtype=dtype)
+    message_byte = packets["message_byte"]
+    return DecodedPackets(
+        packets=packets,
+        # Message id is the first 7 bits of the message id byte
+        message_id=message_byte & 0b1111111,
+        # Panic state is the sign bit of the message id byte
+        panic_state=message_byte < 0,
+    )
+
+
+def decode_frames(buffer):
+    """
+    Decodes a buffer holding a whole number of frames as sent by GNU Radio
+    """
+    return decode_packets(buffer, FRAME_DTYPE)
+
+
+def utc_times(decoded):
+    """
+    Converts the unix times of decoded packets to datetime64 values in UTC
+    """
+    return decoded.packets["unix_time"].astype("datetime64[s]")
@@ -0,0 +1,152 @@
+"""
+This file contains the code for working out the distance, speed and heading
+between the fixes of many beacons at once with NumPy, and for rejecting GPS
+glitches. It is meant for replayed or saved history, where motion.py would
+handle one fix at a time.
+
+With the whole history available a glitch is found by looking at the fixes
+on both sides of it: a fix is rejected when the beacon would have to move
+impossibly fast both to reach it and to leave it again.
+
+Run this file to benchmark it on a million fixes.
+"""
+
+from typing import NamedTuple
+
+import numpy as np
+
+from motion import MAX_SPEED
+from tracks import EARTH_RADIUS
+
+
+class Motions(NamedTuple):
+    """
+    Motion to each fix from the fix before it from the same radio, in the
+    order the fixes were given
+    Distance, speed and heading are NaN for rejected fixes and the first fix of each radio
+    """
+
+    # True where the fix was accepted
+    accepted: np.ndarray
+    # Meters
+    distance: np.ndarray
+    # Meters per second
+    speed: np.ndarray
+    # Degrees clockwise from north
+    heading: np.ndarray
+
+
+def steps(radio_id, unix_time, phi, lambda_, cos_phi):
+    """
+    Returns whether each fix has the same radio as the one after it, and the
+    haversine distance and speed between them, for fixes sorted by radio and
+    time with their latitude phi and longitude lambda_ in radians
+    """
+    same = radio_id[1:] == radio_id[:-1]
+    a = np.sin(np.diff(phi) / 2) ** 2 + cos_phi[:-1] * cos_phi[1:] * np.sin(np.diff(lambda_) / 2) ** 2
+    distance = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1)))
+    # The PLB only sends whole seconds
+    seconds = np.maximum(np.diff(unix_time), 1)
+    return same, distance, distance / seconds
+
+
+def compute_motion(radio_id, unix_time, latitude, longitude, max_speed=MAX_SPEED):
+    """
+    Works out the motion of every fix, given as arrays of the same length
+    Returns a Motions tuple
+    """
+    count = len(radio_id)
+    # Sort by radio, then by time
+    order = np.lexsort((unix_time, radio_id))
+    radio_id = np.asarray(radio_id)[order]
+    unix_time = np.asarray(unix_time, dtype=np.float64)[order]
+    latitude = np.asarray(latitude, dtype=np.float64)[order]
+    longitude = np.asarray(longitude, dtype=np.float64)[order]
+    phi = np.radians(latitude)
+    lambda_ = np.radians(longitude)
+    cos_phi = np.cos(phi)
+
+    # The PLB sends 0, 0 when its GPS has no position, NaN fails every comparison
+    kept = np.flatnonzero(
+        (np.abs(latitude) <= 90)
+        & (np.abs(longitude) <= 180)
+        & ((latitude != 0) | (longitude != 0))
+    )
+    # A glitch needs another fix from the same radio to be told apart
+    if len(kept) > 1:
+        same, _, speed = steps(radio_id[kept], unix_time[kept], phi[kept], lambda_[kept], cos_phi[kept])
+        # Whether each fix has a fix from the same radio before and after it,
+        # and whether the step from it is impossibly fast
+        has_after = np.append(same, False)
+        has_before = np.insert(same, 0, False)
+        fast_after = np.append(same & (speed > max_speed), False)
+        fast_before = np.insert(fast_after[:-1], 0, False)
+        # A fix with both steps fast is a glitch. A fix at the start or end of a
+        # track is a glitch if its only step is fast and its neighbour's other step is not.
+        next_ok = np.append(has_after[1:] & ~fast_after[1:], False)
+        previous_ok = np.insert(has_before[:-1] & ~fast_before[:-1], 0, False)
+        glitch = (
+            (fast_before & fast_after)
+            | (~has_before & fast_after & next_ok)
+            | (~has_after & fast_before & previous_ok)
+        )
+        kept = kept[~glitch]
+
+    # Motion between the accepted fixes
+    phi, lambda_, cos_phi = phi[kept], lambda_[kept], cos_phi[kept]
+    same, distance, speed = steps(radio_id[kept], unix_time[kept], phi, lambda_, cos_phi)
+    # Initial heading from each fix to the next
+    delta_lambda = np.diff(lambda_)
+    sin_phi = np.sin(phi)
+    heading = np.degrees(
+        np.arctan2(
+            np.sin(delta_lambda) * cos_phi[1:],
+            cos_phi[:-1] * sin_phi[1:] - sin_phi[:-1] * cos_phi[1:] * np.cos(delta_lambda),
+        )
+    ) % 360
+    result = Motions(
+        accepted=np.zeros(count, dtype=bool),
+        distance=np.full(count, np.nan),
+        speed=np.full(count, np.nan),
+        heading=np.full(count, np.nan),
+    )
+    # Put the results back in the order the fixes were given
+    result.accepted[order[kept]] = True
+    moved = order[kept[1:][same]]
+    result.distance[moved] = distance[same]
+    result.speed[moved] = speed[same]
+    result.heading[moved] = heading[same]
+    return result
+
+
+def decoded_motion(decoded, max_speed=MAX_SPEED):
+    """
+    Works out the motion of packets decoded with bulk_decode
+    """
+    packets = decoded.packets
+    return compute_motion(
+        packets["radio_id"], packets["unix_time"], packets["latitude"], packets["longitude"], max_speed
+    )
+
+
+if __name__ == "__main__":
+    # Benchmark on a million fixes from a thousand beacons, run this file to compare changes
+    import time
+
+    rng = np.random.default_rng(0)
+    count = 1_000_000
+    radio_id = rng.integers(1, 1001, count)
+    unix_time = 1700000000 + np.arange(count) // 100
+    # Each beacon wanders about 5 meters around its own spot
+    latitude = 37.2 + rng.normal(0, 0.05, 1001)[radio_id] + rng.normal(0, 0.00005, count)
+    longitude = -80.4 + rng.normal(0, 0.05, 1001)[radio_id] + rng.normal(0, 0.00005, count)
+    # Make one fix in a thousand a glitch
+    glitches = rng.random(count) < 0.001
+    latitude[glitches] += 1
+    start = time.perf_counter()
+    motions = compute_motion(radio_id, unix_time, latitude, longitude)
+    seconds = time.perf_counter() - start
+    print(
+        f"{count} fixes in {seconds:.3f} s, rejected {count - motions.accepted.sum()}"
+        f" of {glitches.sum()} glitches"
+    )
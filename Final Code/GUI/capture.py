@@ -0,0 +1,302 @@
+"""
+This file contains the code for recording the raw byte stream from GNU Radio
+to a file and playing it back, so problems seen in the field can be
+reproduced later.
+
+A capture file starts with CAPTURE_MAGIC and the Unix time the capture
+started. Each chunk of received data follows as a record header holding the
+microseconds since the start and the length of the chunk, then the chunk
+itself. A record with no data marks a lost connection.
+
+Run this file to record, inspect or benchmark a capture, see --help.
+"""
+
+import argparse
+import asyncio
+import atexit
+import mmap
+import struct
+import threading
+import time
+
+from framing import FRAME_SIZE
+
+# Marks a file as a capture and holds the format version
+CAPTURE_MAGIC = b"PLBCAP\x00\x01"
+# Unix time the capture started
+CAPTURE_HEADER = struct.Struct("!d")
+# Microseconds since the start of the capture and length of the chunk
+RECORD_HEADER = struct.Struct("!QI")
+# Bytes buffered before they are written to the file
+CAPTURE_BUFFER_SIZE = 2**16
+# Most seconds received data can stay in the buffer before it is written
+CAPTURE_FLUSH_INTERVAL = 1.0
+# Chunks played at full speed before other tasks on the event loop get a turn
+MAX_SPEED_BATCH = 256
+
+
+class CaptureWriter:
+    def __init__(self, path, flush_interval=CAPTURE_FLUSH_INTERVAL):
+        """
+        Creates a CaptureWriter which records received data to a new file at path
+        """
+        self.file = open(path, "wb", buffering=CAPTURE_BUFFER_SIZE)
+        self.flush_interval = flush_interval
+        self.start = time.monotonic()
+        self.last_flush = self.start
+        self.file.write(CAPTURE_MAGIC + CAPTURE_HEADER.pack(time.time()))
+        # Write whatever is buffered if the program exits
+        atexit.register(self.close)
+
+    def write(self, data, at=None):
+        """
+        Records a chunk of received data with the time it was received, or at
+        seconds since the start of the capture if at is given
+        """
+        now = time.monotonic()
+        if at is None:
+            at = now - self.start
+        self.file.write(RECORD_HEADER.pack(round(at * 1e6), len(data)))
+        self.file.write(data)
+        # Don't lose more than the flush interval if the program is killed
+        if now - self.last_flush >= self.flush_interval:
+            self.file.flush()
+            self.last_flush = now
+
+    def disconnected(self):
+        """
+        Records that the connection to GNU Radio was lost
+        """
+        self.write(b"")
+
+    def close(self):
+        """
+        Writes the buffered data and closes the file
+        """
+        self.file.close()
+
+
+class CaptureReader:
+    def __init__(self, path):
+        """
+        Creates a CaptureReader which reads the capture file at path
+        The file is memory mapped so large captures are not read into memory
+        """
+        with open(path, "rb") as file:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mmap[: len(CAPTURE_MAGIC)] != CAPTURE_MAGIC:
+            self.mmap.close()
+            raise ValueError(f"{path} is not a capture file")
+        (self.start_time,) = CAPTURE_HEADER.unpack_from(self.mmap, len(CAPTURE_MAGIC))
+
+    def records(self):
+        """
+        Yields a (seconds since the start, chunk) tuple for every record
+
+        The chunks are memoryviews into the file so they are not copied.
+        Each chunk is only valid until the next one is requested. A record cut
+        off by the program being killed is skipped.
+        """
+        view = memoryview(self.mmap)
+        offset = len(CAPTURE_MAGIC) + CAPTURE_HEADER.size
+        try:
+            while offset + RECORD_HEADER.size <= len(view):
+                microseconds, length = RECORD_HEADER.unpack_from(view, offset)
+                offset += RECORD_HEADER.size
+                if offset + length > len(view):
+                    break
+                chunk = view[offset : offset + length]
+                offset += length
+                try:
+                    yield microseconds / 1e6, chunk
+                finally:
+                    # Release the chunk so the file can be closed
+                    chunk.release()
+        finally:
+            view.release()
+
+    def close(self):
+        """
+        Closes the file
+        """
+        self.mmap.close()
+
+
+async def play(path, on_data, on_disconnect=None, speed=1.0):
+    """
+    Calls on_data with every chunk in the capture file at path with the same
+    timing it was received with, sped up by speed, or as fast as possible if
+    speed is 0. on_disconnect is called where the connection was lost.
+    Returns the number of bytes played.
+    """
+    reader = CaptureReader(path)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    played = 0
+    try:
+        for count, (seconds, chunk) in enumerate(reader.records()):
+            if speed:
+                # Wait until the time the chunk is due rather than the gap since
+                # the last one, so delays don't add up and bursts keep their shape
+                if (delay := start + seconds / speed - loop.time()) > 0:
+                    await asyncio.sleep(delay)
+            elif count % MAX_SPEED_BATCH == 0:
+                await asyncio.sleep(0)
+            if chunk:
+                on_data(chunk)
+                played += len(chunk)
+            elif on_disconnect:
+                on_disconnect()
+    finally:
+        reader.close()
+    return played
+
+
+class ReplaySource:
+    def __init__(
+        self, path, on_data, on_status=None, on_disconnect=None, speed=1.0, loop=None
+    ):
+        """
+        Creates a ReplaySource which plays the capture file at path in place of
+        the connection to GNU Radio
+
+        It takes the same callbacks as NetworkCore, and speed like play. The
+        capture is played once, after which on_status is called with False.
+        """
+        self.path = path
+        self.on_data = on_data
+        self.on_status = on_status
+        self.on_disconnect = on_disconnect
+        self.speed = speed
+        self.own_loop = loop is None
+        self.loop = asyncio.new_event_loop() if self.own_loop else loop
+        self.connected = False
+        # Number of bytes played
+        self.played = 0
+        # Set once the whole capture has been played
+        self.finished = threading.Event()
+
+    def start(self):
+        """
+        Starts the event loop thread and plays the capture
+        """
+        if self.own_loop:
+            threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self.main(), self.loop)
+
+    async def main(self):
+        """
+        Plays the capture
+        """
+        self.update_status(True)
+        try:
+            self.played = await play(self.path, self.on_data, self.on_disconnect, self.speed)
+        finally:
+            self.update_status(False)
+            self.finished.set()
+
+    def send(self, data):
+        """
+        Drops data, since there is no GNU Radio to send it to
+        """
+        pass
+
+    def update_status(self, connected):
+        """
+        Calls on_status when playing starts or stops
+        """
+        self.connected = connected
+        if self.on_status:
+            self.on_status(connected)
+
+
+def record(args):
+    """
+    Records the stream from GNU Radio until interrupted
+    """
+    from network import NetworkCore
+
+    writer = CaptureWriter(args.file)
+    network = NetworkCore(
+        (args.host, args.port),
+        None,
+        on_data=writer.write,
+        on_status=lambda connected: print("Recording" if connected else "Waiting for GNURadio"),
+        on_disconnect=writer.disconnected,
+    )
+    network.start()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+def info(args):
+    """
+    Prints a summary of a capture file
+    """
+    reader = CaptureReader(args.file)
+    chunks = disconnects = size = 0
+    seconds = 0.0
+    for seconds, chunk in reader.records():
+        chunks += 1
+        disconnects += not chunk
+        size += len(chunk)
+    reader.close()
+    started = time.strftime("%m-%d-%Y %H:%M:%S", time.gmtime(reader.start_time))
+    print(
+        f"Started {started} UTC, {seconds:.1f} seconds, {chunks} chunks, "
+        f"{size} bytes (about {size // FRAME_SIZE} packets), {disconnects} disconnects"
+    )
+
+
+def benchmark(args):
+    """
+    Plays a capture through the receive pipeline and prints the throughput
+    """
+    from station import BaseStation
+
+    station = BaseStation(None, replay_path=args.file, replay_speed=args.speed)
+    packets = 0
+
+    def count(packet, point):
+        nonlocal packets
+        packets += 1
+
+    station.subscribe(count)
+    start = time.perf_counter()
+    station.start()
+    station.network.finished.wait()
+    elapsed = time.perf_counter() - start
+    size = station.network.played
+    print(
+        f"{packets} packets ({size} bytes) in {elapsed:.3f} seconds: "
+        f"{packets / elapsed:.0f} packets/s, {size / elapsed / 2**20:.1f} MB/s"
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(required=True)
+    parser_record = commands.add_parser("record", help="record the stream from GNU Radio")
+    parser_record.add_argument("file")
+    parser_record.add_argument("--host", default="localhost")
+    parser_record.add_argument("--port", type=int, default=8080)
+    parser_record.set_defaults(command=record)
+    parser_info = commands.add_parser("info", help="print a summary of a capture")
+    parser_info.add_argument("file")
+    parser_info.set_defaults(command=info)
+    parser_benchmark = commands.add_parser(
+        "benchmark", help="play a capture through the receive pipeline"
+    )
+    parser_benchmark.add_argument("file")
+    parser_benchmark.add_argument(
+        "--speed", type=float, default=0.0, help="speed up factor (0 for as fast as possible)"
+    )
+    parser_benchmark.set_defaults(command=benchmark)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    args.command(args)
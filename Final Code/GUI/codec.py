@@ -0,0 +1,176 @@
+"""
+This file contains the code for encoding and decoding the packets sent by the
+PLB. It is shared by the GUI, the daemon and the emulators so they all read
+packets the same way.
+"""
+
+from datetime import UTC, datetime
+import struct
+
+from framing import HEADER_SIZE, PAYLOAD_SIZE
+
+# Radio ID (unsigned short: H), message byte (unsigned char: B), GPS latitude
+# and longitude (float: f), battery life (unsigned char: B) and Unix time
+# (unsigned int: I), in network byte order
+PACKET_STRUCT = struct.Struct("!HBffBI")
+# Packet with the header that GNU Radio puts in front of it
+FRAME_STRUCT = struct.Struct(f"!{HEADER_SIZE}xHBffBI")
+# The first bit of the message byte is the panic state and the rest is the message id
+PANIC_BIT = 0b10000000
+MESSAGE_ID_MASK = 0b1111111
+TIME_FORMAT = "%m-%d-%Y %H:%M:%S"
+
+
+class PacketLengthError(Exception):
+    """
+    Creates a new error to throw if the packet is not the right length
+    """
+
+    pass
+
+
+class Packet:
+    """
+    A decoded packet from a PLB
+
+    The time and the text shown for the packet are only formatted when they
+    are needed, since most packets are never shown in a popup or printed.
+    """
+
+    __slots__ = (
+        "radio_id",
+        "message_id",
+        "panic_state",
+        "latitude",
+        "longitude",
+        "battery_life",
+        "unix_time",
+        "_popup",
+    )
+
+    def __init__(
+        self, radio_id, message_id, panic_state, latitude, longitude, battery_life, unix_time
+    ):
+        self.radio_id = radio_id
+        self.message_id = message_id
+        self.panic_state = panic_state
+        self.latitude = latitude
+        self.longitude = longitude
+        self.battery_life = battery_life
+        self.unix_time = unix_time
+        # Popup html, formatted the first time it is needed
+        self._popup = None
+
+    @property
+    def utc_time(self):
+        """
+        Time the packet was sent as a UTC string
+        """
+        return datetime.fromtimestamp(self.unix_time, UTC).strftime(TIME_FORMAT)
+
+    def lines(self):
+        """
+        Returns the packet data as lines of text
+        """
+        return [
+            f"Radio ID: {self.radio_id}",
+            f"Message ID: {self.message_id}",
+            f"Panic State: {self.panic_state}",
+            f"Latitude: {self.latitude:.4f}",
+            f"Longitude: {self.longitude:.4f}",
+            f"Battery Life: {self.battery_life:.1f}%",
+            f"Time: {self.utc_time} UTC",
+        ]
+
+    def popup_html(self):
+        """
+        Returns the html for the map marker
+        """
+        if self._popup is None:
+            self._popup = "<br>".join(self.lines())
+        return self._popup
+
+    def log_text(self):
+        """
+        Returns the text printed to the console
+        """
+        return "\n".join(self.lines())
+
+    def encode(self):
+        """
+        Returns the 16 bytes sent by the PLB
+        """
+        return PACKET_STRUCT.pack(
+            self.radio_id,
+            self.message_id | (PANIC_BIT if self.panic_state else 0),
+            self.latitude,
+            self.longitude,
+            self.battery_life,
+            self.unix_time,
+        )
+
+    def frame(self):
+        """
+        Returns the packet with the header GNU Radio puts in front of it
+        """
+        return bytes(HEADER_SIZE) + self.encode()
+
+    def __repr__(self):
+        return (
+            f"Packet(radio_id={self.radio_id}, message_id={self.message_id}, "
+            f"panic_state={self.panic_state}, latitude={self.latitude}, "
+            f"longitude={self.longitude}, battery_life={self.battery_life}, "
+            f"unix_time={self.unix_time})"
+        )
+
+
+def decode(received_data: bytes | memoryview):
+    """
+    Decodes the data packet coming from GNURadio
+    The data is read in place, so a memoryview into a larger buffer is not copied
+
+    Packet Structure:
+     0                   1                   2                   3
+     0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1 2 3 4 5 6 7 8 9 0 1
+    +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
+    |                               |P|             |               |
+    |           Radio ID            |A|  Message ID |   GPS Lat     |
+    |                               |N|             |               |
+    +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
+    |          GPS Latitude (continued)             |   GPS Long    |
+    +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
+    |          GPS Longitude (continued)            | Battery Life  |
+    +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
+    |                           Unix Time                           |
+    +-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+
+    """
+    # Raise exception if packet is not expected length
+    if (packet_length := len(received_data)) != PAYLOAD_SIZE:
+        raise PacketLengthError(
+            f"Expected packet length of {PAYLOAD_SIZE} bytes. Received {packet_length} bytes"
+        )
+    radio_id, message_byte, latitude, longitude, battery_life, unix_time = (
+        PACKET_STRUCT.unpack_from(received_data)
+    )
+    return Packet(
+        radio_id,
+        message_byte & MESSAGE_ID_MASK,
+        message_byte >= PANIC_BIT,
+        latitude,
+        longitude,
+        battery_life,
+        unix_time,
+    )
+
+
+if __name__ == "__main__":
+    # Benchmark decoding, run this file to compare changes to the codec
+    import timeit
+
+    frame = memoryview(Packet(1, 2, True, 37.2, -80.4, 100, 1700000000).frame())[HEADER_SIZE:]
+    for name, function in [
+        ("decode", lambda: decode(frame)),
+        ("decode and popup", lambda: decode(frame).popup_html()),
+    ]:
+        count, seconds = timeit.Timer(function).autorange()
+        print(f"{name}: {seconds / count * 1e6:.2f} us per packet")
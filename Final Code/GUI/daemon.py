@@ -0,0 +1,85 @@
+"""
+This file contains the code for running the base station without the GUI.
+It receives, acknowledges and saves packets from GNU Radio and sends them on
+to any number of GUIs or loggers, so they can share one SDR.
+
+To view the packets, set GNURADIO_RECV_ADDR in gui.py to DAEMON_ADDR,
+GNURADIO_SEND_ADDR to None, since the daemon sends the acknowledgements, and
+DAEMON_MODE to True. The GUI then doesn't save the packets or restore the
+last session, since the daemon saves them to its own PACKET_STORE_PATH.
+
+If more than one base station is listed in RECEIVERS their packets are merged
+into one stream.
+"""
+
+import os
+import threading
+
+from aggregator import Aggregator, Receiver
+from beacons import log_alert
+from metrics import metrics
+from packet_log import setup_logging
+from packet_server import PacketServer
+from station import BaseStation
+
+# The daemon is a client that connects to GNURadio on each base station
+RECEIVERS = [
+    Receiver("local", recv_addr=("localhost", 8080), send_addr=("localhost", 8081)),
+]
+# Subscribers connect to the daemon on this address
+DAEMON_ADDR = ("localhost", 8090)
+# Database that every received packet is saved to
+PACKET_STORE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "packets.db")
+# Record the raw data from GNURadio to this file so it can be played back
+# (None to not record, only used with one receiver)
+CAPTURE_PATH = None
+# Alerts about beacons are logged to this file, which is rotated when it gets large
+LOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "daemon.jsonl")
+# Measure how long each stage takes and count packets, drops and errors
+METRICS_ENABLED = False
+# Serve the measurements in the Prometheus text format on this address
+METRICS_ADDR = ("localhost", 9108)
+
+
+def print_status(name, connected):
+    """
+    Prints whether the daemon is connected to GNURadio on a base station
+    """
+    print(f"{name}: {'Connected to GNURadio' if connected else 'Waiting for GNURadio'}")
+
+
+if __name__ == "__main__":
+    """
+    Main function
+    """
+    # Write the log on a background thread
+    setup_logging(LOG_PATH)
+    if METRICS_ENABLED:
+        metrics.enabled = True
+        metrics.serve(METRICS_ADDR)
+        print(f"Serving metrics on http://{METRICS_ADDR[0]}:{METRICS_ADDR[1]}/metrics")
+    if len(RECEIVERS) == 1:
+        receiver = RECEIVERS[0]
+        station = BaseStation(
+            receiver.recv_addr,
+            receiver.send_addr,
+            PACKET_STORE_PATH,
+            on_status=lambda connected: print_status(receiver.name, connected),
+            capture_path=CAPTURE_PATH,
+        )
+        loop = station.network.loop
+    else:
+        station = Aggregator(RECEIVERS, PACKET_STORE_PATH, on_status=print_status)
+        loop = station.loop
+    # The server runs on the same event loop as the connections to GNURadio
+    server = PacketServer(loop, *DAEMON_ADDR)
+    station.subscribe(lambda packet, point, *heard_by: server.publish(packet))
+    station.beaconTable.subscribe(log_alert)
+    station.start()
+    server.start()
+    print(f"Serving packets on {DAEMON_ADDR[0]}:{DAEMON_ADDR[1]}")
+    try:
+        # Everything runs on other threads
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
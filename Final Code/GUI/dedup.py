@@ -0,0 +1,78 @@
+"""
+This file contains the code for recognizing packets that have already been
+received. The Range Extender retransmits every packet from a PLB, so the base
+station usually hears each packet twice.
+"""
+
+from collections import OrderedDict
+import struct
+import time
+
+# Seconds a packet is remembered for
+DUPLICATE_WINDOW = 60.0
+# Most packets remembered at once
+DUPLICATE_MAX_ENTRIES = 4096
+
+# Radio ID (unsigned short: H), message byte (unsigned char: B)
+_ID_STRUCT = struct.Struct("!HB")
+# Unix time (unsigned int: I) in the last 4 bytes of the packet
+_TIME_STRUCT = struct.Struct("!I")
+
+
+def packet_key(packet):
+    """
+    Returns the (radio_id, message_id, unix_time) key of a 16 byte packet
+    """
+    radio_id, message_byte = _ID_STRUCT.unpack_from(packet, 0)
+    (unix_time,) = _TIME_STRUCT.unpack_from(packet, 12)
+    # The panic bit is not part of the message id
+    return radio_id, message_byte & 0b1111111, unix_time
+
+
+class DuplicateIndex:
+    def __init__(self, window=DUPLICATE_WINDOW, max_entries=DUPLICATE_MAX_ENTRIES):
+        """
+        Creates a DuplicateIndex which remembers packets for window seconds,
+        keeping at most max_entries of them
+        """
+        self.window = window
+        self.max_entries = max_entries
+        # Time each key was first seen, oldest first
+        self.seen_at = OrderedDict()
+        # Latest key for each (radio_id, message_id)
+        self.latest = {}
+        # Number of duplicates dropped, which are usually relayed by the Range Extender
+        self.relayed = 0
+
+    def seen(self, packet):
+        """
+        Returns True if the packet has already been received and remembers it
+        otherwise
+        """
+        key = packet_key(packet)
+        now = time.monotonic()
+        self.evict(now)
+        if key in self.seen_at:
+            self.relayed += 1
+            return True
+        # Message ids roll over after 127, so a new time for the same id is a
+        # new packet and the entry from the last cycle can be forgotten
+        message = key[:2]
+        if (previous := self.latest.get(message)) is not None:
+            self.seen_at.pop(previous, None)
+        self.latest[message] = key
+        self.seen_at[key] = now
+        return False
+
+    def evict(self, now):
+        """
+        Forgets packets that are older than the window or over the size limit
+        """
+        while self.seen_at:
+            key, seen_at = next(iter(self.seen_at.items()))
+            if now - seen_at < self.window and len(self.seen_at) < self.max_entries:
+                break
+            del self.seen_at[key]
+            # Only forget the latest key if it has not been replaced
+            if self.latest.get(key[:2]) == key:
+                del self.latest[key[:2]]
@@ -0,0 +1,61 @@
+"""
+This file contains the code for splitting the TCP byte stream from GNU Radio
+into packets. TCP does not keep message boundaries, so one recv can hold
+several packets or only part of one.
+"""
+
+# Every packet from GNU Radio starts with a header that is not used
+HEADER_SIZE = 4
+# Size of the packet sent by the PLB
+PAYLOAD_SIZE = 16
+FRAME_SIZE = HEADER_SIZE + PAYLOAD_SIZE
+
+
+class FrameDecoder:
+    def __init__(self, header_size=HEADER_SIZE, payload_size=PAYLOAD_SIZE):
+        """
+        Creates a FrameDecoder which keeps received bytes until a whole frame
+        has arrived
+        """
+        self.header_size = header_size
+        self.frame_size = header_size + payload_size
+        # Bytes received that are not part of a frame that has been returned yet
+        self.buffer = bytearray()
+
+    def frames(self, data):
+        """
+        Adds received data to the buffer and yields the payload of every
+        complete frame
+
+        The payloads are memoryviews into the buffer so they are not copied.
+        Each payload is only valid until the next one is requested, so copy
+        anything that has to be kept.
+        """
+        self.buffer += data
+        view = memoryview(self.buffer)
+        offset = 0
+        try:
+            while len(view) - offset >= self.frame_size:
+                payload = view[offset + self.header_size : offset + self.frame_size]
+                offset += self.frame_size
+                try:
+                    yield payload
+                finally:
+                    # Release the payload so the buffer can be resized later
+                    payload.release()
+        finally:
+            view.release()
+            # Remove every frame that was returned and keep any partial frame
+            del self.buffer[:offset]
+
+    def reset(self):
+        """
+        Forgets any partial frame, such as when the connection is lost
+        """
+        self.buffer.clear()
+
+    def pending(self):
+        """
+        Returns the number of bytes waiting for the rest of their frame
+        """
+        return len(self.buffer)
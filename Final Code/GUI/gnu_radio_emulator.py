@@ -1,36 +1,402 @@
 """
 This file is meant to emulate GNU Radio for the purpose of testing
+
+Run without arguments to send a few random packets to each client.
+Run with --benchmark to load test the GUI with many beacons, see --help.
+Run with --replay to send a file recorded with capture.py to the GUI.
 """
 
-import time
+import argparse
+import asyncio
+import math
+import os
+import random
 import socket
 import struct
-import random
+import time
+
+import capture
+from codec import FRAME_STRUCT, PANIC_BIT, Packet
 
 # GNU Radio should listen on this port address
 GNURADIO_SEND_ADDR = ("localhost", 8080)
+# GNU Radio receives acknowledgements on this port address
+GNURADIO_ACK_ADDR = ("localhost", 8081)
 BUFFER_SIZE = 2**12
 
+# Time in seconds the Range Extender waits before retransmitting (SEND_INTERVAL in Range_Extender.ino)
+EXTENDER_SEND_INTERVAL = 1.0
+# Where the simulated beacons start
+START_LATITUDE = 37.227779
+START_LONGITUDE = -80.422289
+
+
 def get_random_packet():
     # Construct an arbitrary packet
-    radio_id = random.randint(0, 65535)
-    message_id = random.randint(-128, 127)
-    latitude = random.uniform(37, 38)
-    longitude = random.uniform(-81, -80)
-    battery_life = random.randint(0, 255)
-    unix_time = int(time.time())  # Get the current Unix time
-    return struct.pack(
-        "!xxxxHbffBI",
-        radio_id,
-        message_id,
-        latitude,
-        longitude,
-        battery_life,
-        unix_time,
+    return Packet(
+        radio_id=random.randint(0, 65535),
+        message_id=random.randint(0, 127),
+        panic_state=random.random() < 0.5,
+        latitude=random.uniform(37, 38),
+        longitude=random.uniform(-81, -80),
+        battery_life=random.randint(0, 255),
+        unix_time=int(time.time()),  # Get the current Unix time
+    ).frame()
+
+
+class Beacon:
+    """
+    A simulated PLB that walks around and counts up its message id
+    """
+
+    __slots__ = ("radio_id", "message_id", "latitude", "longitude", "battery_life")
+
+    def __init__(self, radio_id):
+        self.radio_id = radio_id
+        self.message_id = 0
+        self.latitude = START_LATITUDE + random.uniform(-0.05, 0.05)
+        self.longitude = START_LONGITUDE + random.uniform(-0.05, 0.05)
+        self.battery_life = 100
+
+    def next_frame(self, panic_state):
+        """
+        Returns the next frame sent by the beacon and its (radio_id, message_id) key
+        """
+        # Walk up to about 10 meters in each direction
+        self.latitude += random.uniform(-0.0001, 0.0001)
+        self.longitude += random.uniform(-0.0001, 0.0001)
+        if random.random() < 0.01:
+            self.battery_life = max(self.battery_life - 1, 0)
+        message_id = self.message_id
+        # Increment without using the panic bit, like PLB.ino
+        self.message_id = (self.message_id + 1) & 0b1111111
+        frame = FRAME_STRUCT.pack(
+            self.radio_id,
+            message_id | (PANIC_BIT if panic_state else 0),
+            self.latitude,
+            self.longitude,
+            self.battery_life,
+            int(time.time()),
+        )
+        return frame, (self.radio_id, message_id)
+
+
+def percentile(values, fraction):
+    """
+    Returns the value at fraction (0 to 1) of the sorted values
+    """
+    if not values:
+        return math.nan
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+def memory_usage(pid):
+    """
+    Returns the resident memory of a process in MB, or None if it can't be read
+    """
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def child_pids(pid):
+    """
+    Returns the ids of the processes started by a process and by their children
+    """
+    pids = []
+    try:
+        tasks = os.listdir(f"/proc/{pid}/task")
+    except OSError:
+        return pids
+    for task in tasks:
+        try:
+            with open(f"/proc/{pid}/task/{task}/children") as children:
+                for child in children.read().split():
+                    pids.append(int(child))
+                    pids += child_pids(child)
+        except OSError:
+            # The thread or process has exited
+            pass
+    return pids
+
+
+def tree_memory_usage(pid):
+    """
+    Returns the resident memory in MB of a process and of all its child
+    processes, such as the render process of the GUI, or None if it can't be read
+    """
+    if (memory := memory_usage(pid)) is None:
+        return None
+    children = sum(memory_usage(child) or 0.0 for child in child_pids(pid))
+    return memory, children
+
+
+class Benchmark:
+    def __init__(self, args):
+        """
+        Creates a Benchmark which sends packets to the GUI as configured by args
+        """
+        self.args = args
+        self.beacons = [Beacon(radio_id) for radio_id in range(1, args.beacons + 1)]
+        self.writer = None
+        self.connected = asyncio.Event()
+        # Frames waiting to be coalesced into one write
+        self.coalesced = []
+        # Time each (radio_id, message_id) was first sent, until it is acknowledged
+        self.sent_at = {}
+        # Round trip times in seconds of the acknowledgements in this report interval
+        self.latencies = []
+        self.all_latencies = []
+        # Counters
+        self.sent = 0
+        self.duplicates = 0
+        self.panics = 0
+        self.acks = 0
+        self.unknown_acks = 0
+        self.start_memory = None
+        self.last_report = time.monotonic()
+
+    async def run(self):
+        """
+        Waits for the GUI to connect, then runs the benchmark
+        """
+        ack_server = await asyncio.start_server(self.handle_acks, *GNURADIO_ACK_ADDR)
+        data_server = await asyncio.start_server(self.handle_data, *GNURADIO_SEND_ADDR)
+        async with ack_server, data_server:
+            print(f"Waiting for the GUI to connect to {GNURADIO_SEND_ADDR[0]}:{GNURADIO_SEND_ADDR[1]} ...")
+            await self.connected.wait()
+            print(
+                f"Sending from {self.args.beacons} beacons at {self.args.rate} packets/s "
+                f"({self.args.arrival} arrival) for {self.args.duration} seconds"
+            )
+            if self.args.pid and (memory := tree_memory_usage(self.args.pid)) is not None:
+                self.start_memory = sum(memory)
+            self.last_report = time.monotonic()
+            report = asyncio.create_task(self.report_loop())
+            await self.generate()
+            # Give the last acknowledgements time to arrive
+            await asyncio.sleep(EXTENDER_SEND_INTERVAL)
+            report.cancel()
+            self.report(final=True)
+
+    async def handle_data(self, reader, writer):
+        """
+        Keeps the connection the packets are sent on
+        """
+        sock = writer.get_extra_info("socket")
+        # Send small writes right away so fragments really are separate segments
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.writer = writer
+        self.connected.set()
+        try:
+            await reader.read()
+        except asyncio.CancelledError:
+            # The benchmark is over
+            pass
+
+    async def handle_acks(self, reader, writer):
+        """
+        Reads acknowledgements and measures their round trip time
+        """
+        try:
+            while True:
+                ack = await reader.readexactly(3)
+                now = time.monotonic()
+                radio_id, message_byte = struct.unpack("!HB", ack)
+                key = (radio_id, message_byte & 0b1111111)
+                self.acks += 1
+                if (sent_at := self.sent_at.pop(key, None)) is None:
+                    self.unknown_acks += 1
+                    continue
+                self.latencies.append(now - sent_at)
+        except (asyncio.IncompleteReadError, asyncio.CancelledError):
+            # The GUI disconnected or the benchmark is over
+            pass
+
+    async def generate(self):
+        """
+        Sends packets until the duration is over
+        """
+        args = self.args
+        loop = asyncio.get_running_loop()
+        end = time.monotonic() + args.duration
+        next_send = time.monotonic()
+        while (now := time.monotonic()) < end:
+            if args.arrival == "poisson":
+                next_send += random.expovariate(args.rate)
+                count = 1
+            else:
+                # Bursts of back to back packets at the same average rate
+                next_send += args.burst_size / args.rate
+                count = args.burst_size
+            await asyncio.sleep(max(next_send - now, 0))
+            for _ in range(count):
+                beacon = random.choice(self.beacons)
+                panic_state = random.random() < args.panic
+                frame, key = beacon.next_frame(panic_state)
+                self.sent_at[key] = time.monotonic()
+                self.sent += 1
+                self.panics += panic_state
+                await self.send(frame)
+                # The Range Extender retransmits the packet, so the base station hears it twice
+                if random.random() < args.duplicates:
+                    loop.call_later(
+                        EXTENDER_SEND_INTERVAL,
+                        lambda frame=frame, key=key: asyncio.ensure_future(self.retransmit(frame, key)),
+                    )
+        await self.flush()
+
+    async def retransmit(self, frame, key):
+        """
+        Sends a frame again like the Range Extender, only if it was not
+        acknowledged when --retransmit is unacked
+        """
+        if self.args.retransmit == "always" or key in self.sent_at:
+            self.duplicates += 1
+            await self.send(frame)
+
+    async def send(self, frame):
+        """
+        Sends a frame, coalescing several frames into one write if configured
+        """
+        self.coalesced.append(frame)
+        if len(self.coalesced) >= self.args.coalesce:
+            await self.flush()
+
+    async def flush(self):
+        """
+        Writes the coalesced frames, split into fragments if configured
+        """
+        if not self.coalesced or self.writer is None:
+            return
+        data = b"".join(self.coalesced)
+        self.coalesced.clear()
+        if self.args.fragment:
+            # Split the data at random points so frames cross reads on the other end
+            start = 0
+            while start < len(data):
+                end = start + random.randint(1, self.args.fragment)
+                self.writer.write(data[start:end])
+                await self.writer.drain()
+                start = end
+        else:
+            self.writer.write(data)
+            await self.writer.drain()
+
+    async def report_loop(self):
+        """
+        Prints a report every interval
+        """
+        while True:
+            await asyncio.sleep(self.args.report_interval)
+            self.report()
+
+    def report(self, final=False):
+        """
+        Prints the throughput, acknowledgement latency and memory of the GUI
+        The memory includes the processes the GUI started, since the tracks
+        are kept in its render process
+        """
+        self.all_latencies += self.latencies
+        latencies = sorted(self.all_latencies if final else self.latencies)
+        self.latencies = []
+        elapsed = time.monotonic() - self.last_report
+        self.last_report = time.monotonic()
+        line = (
+            f"{'TOTAL ' if final else ''}sent={self.sent} duplicates={self.duplicates} "
+            f"panics={self.panics} acks={self.acks} unacked={len(self.sent_at)} "
+            f"ack_rtt_ms p50={percentile(latencies, 0.5) * 1000:.1f} "
+            f"p95={percentile(latencies, 0.95) * 1000:.1f} "
+            f"p99={percentile(latencies, 0.99) * 1000:.1f}"
+        )
+        if not final and elapsed:
+            line += f" acked/s={len(latencies) / elapsed:.1f}"
+        if self.args.pid and (memory := tree_memory_usage(self.args.pid)) is not None:
+            gui, children = memory
+            line += f" rss={gui + children:.1f}MB (gui={gui:.1f}MB children={children:.1f}MB)"
+            if self.start_memory is not None:
+                line += f" growth={gui + children - self.start_memory:+.1f}MB"
+        print(line, flush=True)
+
+
+async def replay(args):
+    """
+    Sends a recorded capture to every client that connects
+    """
+
+    async def handle_data(reader, writer):
+        print(f"Replaying {args.replay} at {args.speed or 'full'} speed")
+        played = await capture.play(args.replay, lambda chunk: writer.write(bytes(chunk)), speed=args.speed)
+        await writer.drain()
+        print(f"Replayed {played} bytes")
+
+    async def handle_acks(reader, writer):
+        # Acknowledgements are read and ignored
+        while await reader.read(BUFFER_SIZE):
+            pass
+
+    ack_server = await asyncio.start_server(handle_acks, *GNURADIO_ACK_ADDR)
+    data_server = await asyncio.start_server(handle_data, *GNURADIO_SEND_ADDR)
+    async with ack_server, data_server:
+        await data_server.serve_forever()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--benchmark", action="store_true", help="run the load test")
+    parser.add_argument("--beacons", type=int, default=50, help="number of beacons")
+    parser.add_argument("--rate", type=float, default=100.0, help="packets per second")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds to run")
+    parser.add_argument("--arrival", choices=("poisson", "burst"), default="poisson")
+    parser.add_argument("--burst-size", type=int, default=20, help="packets per burst")
+    parser.add_argument(
+        "--duplicates", type=float, default=0.0,
+        help="fraction of packets the Range Extender retransmits",
+    )
+    parser.add_argument(
+        "--retransmit", choices=("always", "unacked"), default="always",
+        help="retransmit every chosen packet, or only those not acknowledged in time",
     )
+    parser.add_argument("--panic", type=float, default=0.0, help="fraction of panic packets")
+    parser.add_argument(
+        "--coalesce", type=int, default=1, help="frames joined into each write"
+    )
+    parser.add_argument(
+        "--fragment", type=int, default=0,
+        help="split writes into pieces of at most this many bytes (0 to not split)",
+    )
+    parser.add_argument(
+        "--pid", type=int, help="process id of the GUI to measure the memory of, with its child processes"
+    )
+    parser.add_argument("--report-interval", type=float, default=5.0, help="seconds between reports")
+    parser.add_argument("--replay", metavar="FILE", help="send a file recorded with capture.py")
+    parser.add_argument(
+        "--speed", type=float, default=1.0,
+        help="times faster than recorded to replay (0 for as fast as possible)",
+    )
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
+    args = parse_args()
+    if args.replay:
+        try:
+            asyncio.run(replay(args))
+        except KeyboardInterrupt:
+            pass
+        raise SystemExit
+    if args.benchmark:
+        try:
+            asyncio.run(Benchmark(args).run())
+        except KeyboardInterrupt:
+            pass
+        raise SystemExit
+
     # Set up the send socket
     server_send_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_send_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -46,4 +412,4 @@ if __name__ == "__main__":
                 time.sleep(2)
                 packet = get_random_packet()
                 peer_send_socket.send(packet)
-                print(f"Packet sent: {packet}")
\ No newline at end of file
+                print(f"Packet sent: {packet}")
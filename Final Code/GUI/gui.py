@@ -0,0 +1,367 @@
+"""
+This file contains the code for the GUI which receives packets from GNU Radio
+and plots the data on an interactive map running in Qt, and its settings.
+
+Run main.py to start it. The render process imports main.py again when it
+starts, so this file is only imported there when it is run and the render
+process never loads Qt.
+"""
+
+import time
+
+# Taken before anything slow is imported to measure how long the GUI takes to start
+STARTUP_TIME = time.perf_counter()
+
+import os
+import sys
+import threading
+
+from PyQt5 import QtCore, QtWebEngineWidgets, QtWidgets
+
+from beacons import log_alert
+from codec import decode
+import live_map
+from metrics import metrics
+from packet_log import PacketLogger, setup_logging
+from render_worker import RenderWorker
+from scheduler import UpdateScheduler
+from station import BaseStation
+import tile_cache
+from tracks import TRACK_HISTORY_SIZE
+
+# The GUI is a client that connects to GNURadio
+GNURADIO_RECV_ADDR = ("localhost", 8080)
+# Acknowledgements are sent to this address (None to not send any, such as
+# when connected to the base station daemon, which sends them itself)
+GNURADIO_SEND_ADDR = ("localhost", 8081)
+# Set to True when GNURADIO_RECV_ADDR is the base station daemon, which saves
+# the packets itself, so the GUI doesn't save them or restore the last session
+DAEMON_MODE = False
+# Load the map once and send new points to it instead of reloading the whole map
+INCREMENTAL_RENDERING = True
+# Most times per second the map is updated (panic packets are shown right away)
+MAX_REFRESH_RATE = 4
+# Number of waiting points that causes the map to be updated right away
+MAX_BATCH_SIZE = 50
+# Build the map updates in a separate process instead of a thread, so building
+# the map never slows down receiving packets
+RENDER_IN_PROCESS = True
+# Most routine points waiting to be drawn before older ones from the same radio
+# are replaced (panic points are never dropped)
+MAX_PENDING_POINTS = 5000
+# Fit the map to the points received in this many seconds (None fits every point)
+FIT_BOUNDS_WINDOW = None
+# Group nearby markers depending on the zoom level (panic markers are always shown)
+CLUSTER_MARKERS = True
+# Database that every received packet is saved to (not used in DAEMON_MODE)
+PACKET_STORE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "packets.db")
+# Cache for the page of the live map so folium only runs when its settings change
+MAP_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "map_cache")
+# Map tiles are kept in this file so the map works without an internet connection
+TILE_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tiles.mbtiles")
+# The map loads tiles from a server on this address (None to load them from the internet)
+TILE_SERVER_ADDR = ("localhost", 8092)
+# Show the packets from the last time the GUI was open when it starts
+RESTORE_LAST_SESSION = True
+# Record the raw data from GNURadio to this file so it can be played back (None to not record)
+CAPTURE_PATH = None
+# Play this recorded file instead of connecting to GNURadio (None to connect)
+REPLAY_PATH = None
+# Times faster than recorded to play the file (0 for as fast as possible)
+REPLAY_SPEED = 1.0
+# Received packets are logged to this file, which is rotated when it gets large
+LOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "basestation.jsonl")
+# Measure how long each stage takes and count packets, drops and errors
+METRICS_ENABLED = False
+# Serve the measurements in the Prometheus text format on this address (None to not serve them)
+METRICS_ADDR = ("localhost", 9108)
+# Show the measurements over the map (toggled with F12)
+SHOW_DEBUG_OVERLAY = False
+
+
+class MapManager(QtCore.QObject):
+    # Qt signal for transmitting html back to the GUI thread
+    htmlChanged = QtCore.pyqtSignal(str)
+    # Qt signal for transmitting JavaScript that updates the loaded map
+    scriptReady = QtCore.pyqtSignal(str)
+    # Qt signal for telling the GUI whether it is connected to GNURadio
+    connectionChanged = QtCore.pyqtSignal(bool)
+
+    def __init__(self):
+        """
+        Creates a MapManager QObject which can receive data from GNURadio
+        and add it to a folium map and update the GUI
+        """
+        super().__init__()
+        # Receives, acknowledges and saves packets from GNURadio
+        self.station = BaseStation(
+            GNURADIO_RECV_ADDR,
+            GNURADIO_SEND_ADDR,
+            # The daemon saves the packets itself
+            None if DAEMON_MODE else PACKET_STORE_PATH,
+            on_status=self.connectionChanged.emit,
+            capture_path=CAPTURE_PATH,
+            replay_path=REPLAY_PATH,
+            replay_speed=REPLAY_SPEED,
+        )
+        self.station.subscribe(self.packet_received)
+        # Tell the operator when a beacon stops reporting
+        self.station.beaconTable.subscribe(log_alert)
+        # Address the tile server is running on, or None to load tiles from the internet
+        self.tileServerAddr = None
+        self.tiles = None
+        if TILE_SERVER_ADDR:
+            # Serves map tiles from the disk, downloading the ones that are missing
+            self.tileCache = tile_cache.TileCache(TILE_CACHE_PATH)
+            try:
+                server = self.tileCache.serve(TILE_SERVER_ADDR)
+            except OSError as err:
+                # Show the map with tiles from the internet rather than not at all
+                print(f"Error starting the tile server: {err}", file=sys.stderr)
+            else:
+                self.tileServerAddr = server.server_address[:2]
+                self.tiles = f"{tile_cache.server_url(self.tileServerAddr)}/{{z}}/{{x}}/{{y}}.png"
+        # Keeps the tracks and builds the map updates away from the network thread
+        self.renderWorker = RenderWorker(
+            self.map_rendered,
+            (INCREMENTAL_RENDERING, CLUSTER_MARKERS, self.tiles, FIT_BOUNDS_WINDOW),
+            RENDER_IN_PROCESS,
+        )
+        metrics.gauge("render_coalesced", lambda: self.renderWorker.coalesced)
+        metrics.gauge("render_dropped", lambda: self.renderWorker.dropped)
+        metrics.gauge("render_restarts", lambda: self.renderWorker.restarts)
+        # Logs every received point before the scheduler can coalesce or drop
+        # it, without printing each one on the network thread
+        self.packetLogger = PacketLogger()
+        # Collects decoded points and adds them to the map in batches
+        # Under overload only the newest routine point of each radio is kept
+        self.scheduler = UpdateScheduler(
+            self.add_points,
+            MAX_REFRESH_RATE,
+            MAX_BATCH_SIZE,
+            MAX_PENDING_POINTS,
+            coalesce_key=lambda point: point.radio_id,
+        )
+
+    def start(self):
+        """
+        Draws the last session and starts receiving from GNURadio on a separate thread
+        """
+        self.packetLogger.start()
+        threading.Thread(target=self.restore_and_start, daemon=True).start()
+
+    def restore_and_start(self):
+        """
+        Loads the last session, then starts receiving from GNURadio
+        Runs on its own thread so loading never holds up the GUI
+        """
+        if RESTORE_LAST_SESSION and self.station.packetStore:
+            # Add the packets from the last session before new ones can arrive
+            # Tracks only keep their newest points, so only those are loaded
+            now = time.monotonic()
+            packets = self.station.packetStore.last_session(TRACK_HISTORY_SIZE)
+            self.renderWorker.submit([(now, decode(packet)) for packet in packets], full=True)
+        self.station.start()
+
+    def packet_received(self, packet, point):
+        """
+        Queues a new point to be added to the map
+        Runs on the network thread so it must not block
+        """
+        # Log the packet, routine packets are summarized for busy radios
+        self.packetLogger.log_packet(point)
+        # Panic points are added to the map right away
+        self.scheduler.submit(point, urgent=point.panic_state)
+
+    def load_HTML(self):
+        """
+        Loads the html of the empty map
+        The points are added by the scripts or html that follow it
+        """
+        html = live_map.shell_html(CLUSTER_MARKERS, MAP_CACHE_DIR, self.tiles)
+        if self.tileServerAddr:
+            # Load Leaflet and its plugins through the cache as well
+            html = self.tileCache.offline_html(html, self.tileServerAddr)
+        return html
+
+    def add_points(self, points):
+        """
+        Sends a batch of points to the render worker, which updates the GUI once
+        Called by the scheduler
+        """
+        now = time.monotonic()
+        self.renderWorker.submit([(now, point) for point in points])
+
+    def map_rendered(self, kind, payload, seconds):
+        """
+        Sends a map update from the render worker to the GUI
+        Called on a render worker thread
+        """
+        metrics.observe_duration("render", seconds)
+        if kind == "script":
+            # Send only the changed tracks to the map that is already loaded
+            self.scriptReady.emit(payload)
+        else:
+            if self.tileServerAddr:
+                payload = self.tileCache.offline_html(payload, self.tileServerAddr)
+            # Update the map in the GUI by emitting a signal
+            self.htmlChanged.emit(payload)
+
+
+class BaseStationGUI(QtWidgets.QWidget):
+    """
+    Creates a GUI which has a map for displaying markers
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.initUI()
+
+    def initUI(self):
+        """
+        Initialize the UI for the GUI
+        """
+        # Create a window for the GUI
+        self.webEngineView = QtWebEngineWidgets.QWebEngineView()
+
+        # Create layout and add web engine view
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.addWidget(self.webEngineView)
+        layout.setContentsMargins(0, 0, 0, 0)
+
+        if METRICS_ENABLED:
+            # Shows the measurements over the map
+            self.debugOverlay = QtWidgets.QLabel(self)
+            self.debugOverlay.setStyleSheet(
+                "background-color: rgba(0, 0, 0, 160); color: white; font-family: monospace; padding: 6px"
+            )
+            self.debugOverlay.move(10, 10)
+            self.debugOverlay.setVisible(SHOW_DEBUG_OVERLAY)
+            QtWidgets.QShortcut(QtCore.Qt.Key_F12, self, self.toggleDebugOverlay)
+            self.debugTimer = QtCore.QTimer(self)
+            self.debugTimer.timeout.connect(self.updateDebugOverlay)
+            self.debugTimer.start(1000)
+
+        # Set the window size
+        self.resize(1280, 720)
+        # Set the window title
+        self.setConnected(False)
+        # Show the window to the screen
+        self.show()
+        # Load the map once the empty window has been drawn
+        QtCore.QTimer.singleShot(0, self.startMap)
+
+    def startMap(self):
+        """
+        Loads the map and starts receiving from GNURadio
+        """
+        print(f"Window shown after {time.perf_counter() - STARTUP_TIME:.2f} seconds")
+        # Create a worker for processing signals
+        self.mapManager = MapManager()
+
+        # Scripts received before the map has finished loading are held until it is ready
+        self.mapLoaded = False
+        self.firstLoad = True
+        self.pendingScripts = []
+        self.webEngineView.loadFinished.connect(self.mapLoadFinished)
+        # Load initial map to the GUI
+        self.setMapHtml(self.mapManager.load_HTML())
+        # Connect htmlChanged signal to setHtml slot
+        self.mapManager.htmlChanged.connect(self.setMapHtml)
+        # Connect scriptReady signal to run the script on the loaded map
+        self.mapManager.scriptReady.connect(self.runMapScript)
+        # Show whether the GUI is connected to GNURadio in the title
+        self.mapManager.connectionChanged.connect(self.setConnected)
+        # Draws the last session and connects to GNURadio in the background so
+        # the window stays responsive
+        self.mapManager.start()
+
+    def setConnected(self, connected):
+        """
+        Updates the window title with the connection to GNURadio
+        """
+        if connected:
+            self.setWindowTitle("Base station GUI")
+        else:
+            self.setWindowTitle("Base station GUI (waiting for GNURadio)")
+
+    def setMapHtml(self, html):
+        """
+        Loads a new map in the web view
+        """
+        self.mapLoaded = False
+        self.loadStarted = metrics.now()
+        self.webEngineView.setHtml(html)
+
+    def mapLoadFinished(self, ok):
+        """
+        Runs any scripts that were received while the map was loading
+        """
+        metrics.observe("page_load", self.loadStarted)
+        if self.firstLoad:
+            self.firstLoad = False
+            # Time until the operator can see the map, the number that matters in the field
+            startup = time.perf_counter() - STARTUP_TIME
+            metrics.observe_duration("startup", startup)
+            print(f"Map shown after {startup:.2f} seconds")
+        self.mapLoaded = ok
+        if ok:
+            for script in self.pendingScripts:
+                self.runJavaScript(script)
+            self.pendingScripts.clear()
+
+    def runMapScript(self, script):
+        """
+        Runs a script on the map, or holds it until the map has loaded
+        """
+        if self.mapLoaded:
+            self.runJavaScript(script)
+        else:
+            self.pendingScripts.append(script)
+
+    def runJavaScript(self, script):
+        """
+        Runs a script on the loaded map
+        """
+        if metrics.enabled:
+            # Measure the time until the map has been updated
+            start = metrics.now()
+            self.webEngineView.page().runJavaScript(
+                script, lambda result: metrics.observe("map_script", start)
+            )
+        else:
+            self.webEngineView.page().runJavaScript(script)
+
+    def toggleDebugOverlay(self):
+        """
+        Shows or hides the measurements over the map
+        """
+        self.debugOverlay.setVisible(not self.debugOverlay.isVisible())
+        self.updateDebugOverlay()
+
+    def updateDebugOverlay(self):
+        """
+        Shows the latest measurements over the map
+        """
+        if self.debugOverlay.isVisible():
+            self.debugOverlay.setText(metrics.summary() or "No packets yet")
+            self.debugOverlay.adjustSize()
+            self.debugOverlay.raise_()
+
+
+def main():
+    """
+    Starts the GUI
+    """
+    # Write the log on a background thread
+    setup_logging(LOG_PATH)
+    if METRICS_ENABLED:
+        metrics.enabled = True
+        if METRICS_ADDR:
+            metrics.serve(METRICS_ADDR)
+    # Creates a QApplication to display
+    app = QtWidgets.QApplication(sys.argv)
+    # Creates the GUI
+    gui = BaseStationGUI()
+    # Exit is handled by Qt
+    sys.exit(app.exec_())
\ No newline at end of file
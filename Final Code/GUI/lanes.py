@@ -0,0 +1,124 @@
+"""
+This file contains the queue used between the stages that handle received
+packets. Panic packets go in their own lane which is always taken first and
+never dropped. Routine packets go in a bounded lane and are shed or
+coalesced when a stage can't keep up, so a backlog of routine packets never
+delays a panic packet.
+"""
+
+from collections import deque
+import threading
+import time
+
+
+class LaneQueue:
+    def __init__(self, max_routine, coalesce_key=None, notify_at=1):
+        """
+        Creates a LaneQueue which holds at most max_routine routine items
+
+        When the routine lane is full a new item replaces the waiting item
+        with the same coalesce_key(item) if there is one, otherwise the oldest
+        routine item is dropped. Panic items are never dropped.
+
+        A waiting consumer is woken by a panic item, the first item, and when
+        notify_at items are waiting.
+        """
+        self.max_routine = max_routine
+        self.coalesce_key = coalesce_key
+        self.notify_at = notify_at
+        self.panic = deque()
+        # Each routine item is kept in a one item list so it can be replaced in place
+        self.routine = deque()
+        # Waiting routine item of each coalesce key
+        self.latest = {}
+        self.condition = threading.Condition()
+        # Counters
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_panic_depth = 0
+
+    def put(self, item, panic=False):
+        """
+        Adds an item without blocking
+        Returns False if a routine item had to be dropped or replaced to make room
+        """
+        with self.condition:
+            if panic:
+                self.panic.append(item)
+                self.max_panic_depth = max(self.max_panic_depth, len(self.panic))
+                self.condition.notify()
+                return True
+            key = self.coalesce_key(item) if self.coalesce_key else None
+            if len(self.routine) < self.max_routine:
+                self.append(key, item)
+                if len(self) in (1, self.notify_at):
+                    self.condition.notify()
+                return True
+            if (box := self.latest.get(key)) is not None:
+                # Keep the newest item of the key in the place of the old one
+                box[0] = item
+                self.coalesced += 1
+                return False
+            self.popleft()
+            self.dropped += 1
+            self.append(key, item)
+            return False
+
+    def append(self, key, item):
+        """
+        Adds a routine item to the end of the lane
+        Must be called with the lock held
+        """
+        box = [item]
+        self.routine.append((key, box))
+        if self.coalesce_key:
+            self.latest[key] = box
+
+    def popleft(self):
+        """
+        Removes and returns the oldest routine item
+        Must be called with the lock held
+        """
+        key, box = self.routine.popleft()
+        if self.coalesce_key and self.latest.get(key) is box:
+            del self.latest[key]
+        return box[0]
+
+    def get_batch(self, max_items=None, timeout=None):
+        """
+        Waits for at least one item, then returns up to max_items items with
+        every panic item first, or an empty list if timeout seconds pass first
+        """
+        with self.condition:
+            if not self.condition.wait_for(self.__len__, timeout):
+                return []
+            return self.take(max_items)
+
+    def take(self, max_items=None):
+        """
+        Returns up to max_items waiting items without waiting, panic items first
+        Must be called with the lock held
+        """
+        batch = list(self.panic)
+        self.panic.clear()
+        while self.routine and (max_items is None or len(batch) < max_items):
+            batch.append(self.popleft())
+        return batch
+
+    def panic_waiting(self):
+        """
+        Returns True if a panic item is waiting
+        """
+        return bool(self.panic)
+
+    def wait(self, predicate, timeout):
+        """
+        Waits until predicate returns True or timeout seconds pass
+        Must be called with the lock held
+        """
+        end = time.monotonic() + timeout
+        while not predicate() and (remaining := end - time.monotonic()) > 0:
+            self.condition.wait(remaining)
+
+    def __len__(self):
+        return len(self.panic) + len(self.routine)
@@ -0,0 +1,119 @@
+"""
+This file contains the code for the live map in the GUI: the page that is
+loaded once and the JavaScript that updates it as packets are received.
+
+It does not import folium, which is slow to import, so the GUI can start
+quickly. The page is built with folium by map_render the first time it is
+needed and cached on disk for the next start.
+"""
+
+import hashlib
+from importlib import metadata
+import json
+import os
+
+from tracks import TRACK_HISTORY_SIZE
+
+# Where the map starts before any points are received
+MAP_CENTER = [37.227779, -80.422289]
+MAP_ZOOM = 13
+# Padding in degrees added around the points when fitting the map bounds
+BOUNDS_PADDING = 0.01
+
+
+def shell_key(cluster, tiles=None):
+    """
+    Returns a key that changes whenever the page for the live map would change
+    """
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "map_render.py"), "rb") as file:
+        source = file.read()
+    settings = {
+        "folium": metadata.version("folium"),
+        "branca": metadata.version("branca"),
+        "center": MAP_CENTER,
+        "zoom": MAP_ZOOM,
+        "history_size": TRACK_HISTORY_SIZE,
+        "cluster": cluster,
+        "tiles": tiles,
+        # The template in map_render can change without a new version
+        "map_render": hashlib.sha256(source).hexdigest(),
+    }
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def shell_html(cluster=True, cache_dir=None, tiles=None):
+    """
+    Returns the html of an empty map with a LiveLayer and tiles loaded from
+    the url template tiles, or OpenStreetMap if it is None
+
+    The html is read from cache_dir if it was built before with the same
+    settings, otherwise it is built and saved there. Nothing is cached if
+    cache_dir is None.
+    """
+    path = os.path.join(cache_dir, f"map_shell_{shell_key(cluster, tiles)}.html") if cache_dir else None
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as file:
+            return file.read()
+    # Only import folium if the page has to be built
+    import map_render
+
+    html = map_render.map_html(map_render.shell_map(cluster, tiles))
+    if path:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a temporary file first so a half written page is never read
+        with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+            file.write(html)
+        os.replace(f"{path}.tmp", path)
+    return html
+
+
+def update_tracks_script(updates, bounds=None, full=False):
+    """
+    Creates the JavaScript that updates the tracks on a map with a LiveLayer
+    and fits the map to bounds
+    If full is True the updates hold the whole history of every track, which
+    replaces the lines already on the map
+
+    Each update is a (radio_id, latitude, longitude, packet, added, panic_state)
+    tuple where packet is the Packet shown in the popup and added is True if the
+    position was added to the history of the track.
+    bounds is a (southwest, northeast) tuple or None to leave the map where it is
+
+    The updates of each radio are merged so its marker and popup are only sent
+    once, with the positions added to its line since the last script.
+    """
+    tracks = {}
+    for radio_id, latitude, longitude, packet, added, panic_state in updates:
+        if (track := tracks.get(radio_id)) is None:
+            track = tracks[radio_id] = {"radio_id": radio_id, "added": []}
+        track["latitude"] = latitude
+        track["longitude"] = longitude
+        track["popup"] = packet
+        track["panic"] = panic_state
+        if added:
+            track["added"].append((latitude, longitude))
+    for track in tracks.values():
+        # Only the newest packet is shown and only the history is kept on the line
+        track["popup"] = track["popup"].popup_html()
+        del track["added"][:-TRACK_HISTORY_SIZE]
+    # JSON is valid JavaScript so the updates can be passed directly
+    data = json.dumps(list(tracks.values()))
+    return f"updateTracks({data}, {json.dumps(bounds)}, {json.dumps(full)});"
+
+
+def track_updates(tracks):
+    """
+    Returns the updates for update_tracks_script that draw tracks from scratch
+    """
+    updates = []
+    for track in tracks:
+        # Replay the history, then move the marker to the latest position
+        for fix in track.history:
+            updates.append(
+                (track.radio_id, fix.latitude, fix.longitude, track.popup, True, track.panic_state)
+            )
+        latest = track.latest
+        updates.append(
+            (track.radio_id, latest.latitude, latest.longitude, track.popup, False, track.panic_state)
+        )
+    return updates
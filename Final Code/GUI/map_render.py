@@ -0,0 +1,172 @@
+"""
+This file contains the code for building the folium map. The live map is
+rendered once and new points are sent to it as small JavaScript calls made
+by live_map, which only imports this file when the page is not cached.
+"""
+
+import io
+
+from branca.element import MacroElement
+import folium
+from folium.elements import JSCSSMixin
+from folium.plugins import MarkerCluster
+from jinja2 import Template
+
+from live_map import MAP_CENTER, MAP_ZOOM
+from tile_cache import TILE_ATTRIBUTION
+from tracks import TRACK_HISTORY_SIZE
+
+
+def new_map(tiles=None):
+    """
+    Creates an empty folium map
+    Tiles are loaded from the url template tiles, or OpenStreetMap if it is None
+    """
+    if tiles is None:
+        return folium.Map(location=MAP_CENTER, zoom_start=MAP_ZOOM)
+    return folium.Map(location=MAP_CENTER, zoom_start=MAP_ZOOM, tiles=tiles, attr=TILE_ATTRIBUTION)
+
+
+class LiveLayer(JSCSSMixin, MacroElement):
+    """
+    Adds a layer and an updateTracks() JavaScript function to a folium map so
+    tracks can be updated after the page has been loaded
+
+    If cluster is True nearby markers are grouped together depending on the
+    zoom level, except for radios in the panic state which are always shown
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var live_map = {{ this._parent.get_name() }};
+            var live_layer = L.featureGroup().addTo(live_map);
+            // Markers of radios that are not in the panic state
+            {% if this.cluster %}
+            var live_markers = L.markerClusterGroup({chunkedLoading: true}).addTo(live_map);
+            {% else %}
+            var live_markers = live_layer;
+            {% endif %}
+            var panic_icon = L.AwesomeMarkers.icon(
+                {icon: "exclamation-sign", markerColor: "red", prefix: "glyphicon"}
+            );
+            // Marker and line for each radio
+            var live_tracks = {};
+            // The map is fit to the points until the user moves or zooms it
+            var live_follow = true;
+            // Set while updateTracks moves the map, so only the user stops the fitting
+            var live_fitting = false;
+            live_map.on("movestart zoomstart", function () {
+                if (!live_fitting) {
+                    live_follow = false;
+                }
+            });
+            function updateTracks(updates, bounds, full) {
+                if (full) {
+                    // The updates hold the whole history of every track
+                    for (const track of Object.values(live_tracks)) {
+                        track.line.setLatLngs([]);
+                    }
+                }
+                for (const update of updates) {
+                    const latlng = L.latLng(update.latitude, update.longitude);
+                    let track = live_tracks[update.radio_id];
+                    if (track === undefined) {
+                        track = live_tracks[update.radio_id] = {
+                            marker: L.marker(latlng)
+                                .bindPopup("", {minWidth: 250, maxWidth: 250}),
+                            line: L.polyline([]).addTo(live_layer),
+                            panic: false,
+                        };
+                    } else {
+                        // Clusters are only updated when a marker is added to them
+                        (track.panic ? live_layer : live_markers).removeLayer(track.marker);
+                    }
+                    // Move the marker to the latest position
+                    track.marker.setLatLng(latlng).setPopupContent(update.popup);
+                    if (update.panic !== track.panic) {
+                        track.marker.setIcon(update.panic ? panic_icon : new L.Icon.Default());
+                        track.panic = update.panic;
+                    }
+                    // Radios in the panic state are never hidden in a cluster
+                    (track.panic ? live_layer : live_markers).addLayer(track.marker);
+                    if (update.added.length) {
+                        // Keep the same number of positions as the history in Python
+                        const latlngs = track.line.getLatLngs().concat(
+                            update.added.map((position) => L.latLng(position))
+                        );
+                        track.line.setLatLngs(latlngs.slice(-{{ this.history_size }}));
+                    }
+                }
+                // The bounds are kept up to date in Python
+                if (bounds !== null && live_follow) {
+                    // Without the animation the move events fire right away
+                    live_fitting = true;
+                    live_map.fitBounds(bounds, {animate: false});
+                    live_fitting = false;
+                }
+            }
+            {{ this.initial_script }}
+        {% endmacro %}
+        """
+    )
+
+    default_js = MarkerCluster.default_js
+    default_css = MarkerCluster.default_css
+
+    def __init__(self, history_size=TRACK_HISTORY_SIZE, cluster=True, initial_script=""):
+        super().__init__()
+        self._name = "LiveLayer"
+        self.history_size = history_size
+        self.cluster = cluster
+        # Script from live_map.update_tracks_script that runs when the page loads
+        self.initial_script = initial_script
+
+
+def shell_map(cluster=True, tiles=None):
+    """
+    Creates an empty folium map with a LiveLayer
+    """
+    map = new_map(tiles)
+    LiveLayer(cluster=cluster).add_to(map)
+    return map
+
+
+def map_html(map):
+    """
+    Returns the html of a folium map
+    """
+    # Create data variable to output to
+    data = io.BytesIO()
+    # Save the map to the data variable
+    map.save(data, close_file=False)
+    # Return the html as a string
+    return data.getvalue().decode()
+
+
+def tracks_map(tracks, bounds=None, cluster=True, tiles=None):
+    """
+    Creates a folium map with a marker at the latest position of each track
+    and a line through its history
+
+    If cluster is True nearby markers are grouped like in the LiveLayer
+    """
+    map = new_map(tiles)
+    markers = MarkerCluster().add_to(map) if cluster else map
+    for track in tracks:
+        folium.PolyLine(
+            [(fix.latitude, fix.longitude) for fix in track.history]
+        ).add_to(map)
+        # Make a popup with all the packet data
+        iframe = folium.IFrame(track.popup.popup_html())
+        popup = folium.Popup(iframe, min_width=250, max_width=250)
+        location = (track.latest.latitude, track.latest.longitude)
+        if track.panic_state:
+            # Radios in the panic state are never hidden in a cluster
+            icon = folium.Icon(color="red", icon="exclamation-sign")
+            folium.Marker(location=location, popup=popup, icon=icon).add_to(map)
+        else:
+            folium.Marker(location=location, popup=popup).add_to(markers)
+    if bounds:
+        map.fit_bounds(bounds)
+    return map
@@ -0,0 +1,138 @@
+"""
+This file contains the code for measuring how long each stage of the packet
+pipeline takes and how many packets pass through it. The measurements can be
+read from a local HTTP endpoint in the Prometheus text format or shown in the
+GUI. When metrics are disabled every call returns right away.
+"""
+
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+
+# Number of recent samples kept for each stage
+HISTOGRAM_SIZE = 1024
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Metrics:
+    def __init__(self, enabled=False, histogram_size=HISTOGRAM_SIZE):
+        """
+        Creates a Metrics object which keeps counters, stage timings and gauges
+        """
+        self.enabled = enabled
+        self.histogram_size = histogram_size
+        self.counters = {}
+        # Recent durations in seconds of each stage
+        self.histograms = {}
+        # Number of samples ever recorded for each stage
+        self.observations = {}
+        # Functions returning the current value of each gauge, such as a queue depth
+        self.gauges = {}
+
+    def now(self):
+        """
+        Returns the start time of a stage, to be passed to observe
+        """
+        return time.perf_counter() if self.enabled else 0.0
+
+    def observe(self, stage, start):
+        """
+        Records the time since start as a sample of stage
+        """
+        if not self.enabled:
+            return
+        self.observe_duration(stage, time.perf_counter() - start)
+
+    def observe_duration(self, stage, duration):
+        """
+        Records a duration in seconds as a sample of stage
+        """
+        if not self.enabled:
+            return
+        if (histogram := self.histograms.get(stage)) is None:
+            histogram = self.histograms[stage] = deque(maxlen=self.histogram_size)
+        histogram.append(duration)
+        self.observations[stage] = self.observations.get(stage, 0) + 1
+
+    def count(self, name, amount=1):
+        """
+        Adds amount to a counter
+        """
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def gauge(self, name, function):
+        """
+        Registers a function that returns the current value of a gauge
+        """
+        self.gauges[name] = function
+
+    def quantiles(self, stage):
+        """
+        Returns the 50th, 95th and 99th percentile of the recent samples of stage
+        """
+        samples = sorted(self.histograms.get(stage, ()))
+        if not samples:
+            return tuple(float("nan") for _ in QUANTILES)
+        return tuple(samples[min(int(q * len(samples)), len(samples) - 1)] for q in QUANTILES)
+
+    def prometheus(self):
+        """
+        Returns the metrics in the Prometheus text format
+        """
+        lines = []
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"# TYPE basestation_{name}_total counter")
+            lines.append(f"basestation_{name}_total {value}")
+        for name, function in sorted(self.gauges.items()):
+            lines.append(f"# TYPE basestation_{name} gauge")
+            lines.append(f"basestation_{name} {function()}")
+        lines.append("# TYPE basestation_stage_seconds summary")
+        for stage in sorted(self.histograms):
+            for q, value in zip(QUANTILES, self.quantiles(stage)):
+                lines.append(f'basestation_stage_seconds{{stage="{stage}",quantile="{q}"}} {value}')
+            lines.append(f'basestation_stage_seconds_count{{stage="{stage}"}} {self.observations[stage]}')
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """
+        Returns the metrics as lines of text for showing in the GUI
+        """
+        lines = [f"{name}: {value}" for name, value in sorted(self.counters.items())]
+        lines += [f"{name}: {function()}" for name, function in sorted(self.gauges.items())]
+        for stage in sorted(self.histograms):
+            p50, p95, p99 = (value * 1000 for value in self.quantiles(stage))
+            lines.append(f"{stage}: p50 {p50:.2f} ms, p95 {p95:.2f} ms, p99 {p99:.2f} ms")
+        return "\n".join(lines)
+
+    def serve(self, addr):
+        """
+        Serves the metrics at http://host:port/metrics on a separate thread
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Don't print every request to the console
+                pass
+
+        server = ThreadingHTTPServer(addr, Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+# Metrics shared by the whole program, enabled by gui.py or daemon.py
+metrics = Metrics()
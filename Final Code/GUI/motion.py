@@ -0,0 +1,132 @@
+"""
+This file contains the code for working out how each PLB is moving from its
+GPS fixes: the distance, speed and heading since its last fix. A fix that
+would need the beacon to move impossibly fast is a GPS glitch and is
+rejected, so it never moves the marker or stretches the map bounds.
+
+Each fix is only compared with the last accepted fix of its beacon, so the
+cost per packet is constant. bulk_motion.py does the same for many fixes at
+once with NumPy.
+"""
+
+import math
+
+from tracks import distance
+
+# Fastest a PLB is expected to move in meters per second (about 180 km/h)
+MAX_SPEED = 50.0
+# After this many fixes in a row are rejected for speed the next one is
+# accepted, since the beacon really moved or the fix it is compared with was the glitch
+MAX_REJECTED = 3
+
+
+def bearing(latitude1, longitude1, latitude2, longitude2):
+    """
+    Returns the initial heading in degrees clockwise from north from one point to another
+    """
+    phi1 = math.radians(latitude1)
+    phi2 = math.radians(latitude2)
+    delta_lambda = math.radians(longitude2 - longitude1)
+    y = math.sin(delta_lambda) * math.cos(phi2)
+    x = math.cos(phi1) * math.sin(phi2) - math.sin(phi1) * math.cos(phi2) * math.cos(delta_lambda)
+    return math.degrees(math.atan2(y, x)) % 360
+
+
+def valid_fix(latitude, longitude):
+    """
+    Returns False for a position that can't be a real fix
+    The PLB sends 0, 0 when its GPS has no position
+    """
+    return (
+        abs(latitude) <= 90
+        and abs(longitude) <= 180
+        and (latitude != 0 or longitude != 0)
+    )
+
+
+class Motion:
+    """
+    Last accepted fix of a beacon and how it moved to get there
+    """
+
+    __slots__ = (
+        "time",
+        "latitude",
+        "longitude",
+        "distance",
+        "speed",
+        "heading",
+        "travelled",
+        "rejected",
+        "total_rejected",
+    )
+
+    def __init__(self):
+        # Unix time and position of the last accepted fix
+        self.time = None
+        self.latitude = None
+        self.longitude = None
+        # Meters, meters per second and degrees from the fix before it
+        self.distance = 0.0
+        self.speed = 0.0
+        self.heading = None
+        # Meters between all the accepted fixes
+        self.travelled = 0.0
+        # Fixes rejected for speed since the last accepted one, and rejected fixes in total
+        self.rejected = 0
+        self.total_rejected = 0
+
+    def update(self, unix_time, latitude, longitude, max_speed=MAX_SPEED, max_rejected=MAX_REJECTED):
+        """
+        Moves to a new fix unless it is a glitch
+        Returns True if the fix was accepted
+        """
+        # Also catches NaN, which fails every comparison
+        if not valid_fix(latitude, longitude):
+            self.total_rejected += 1
+            return False
+        if self.time is not None:
+            # The PLB only sends whole seconds
+            seconds = max(unix_time - self.time, 1)
+            meters = distance(self.latitude, self.longitude, latitude, longitude)
+            if meters / seconds > max_speed and self.rejected < max_rejected:
+                self.rejected += 1
+                self.total_rejected += 1
+                return False
+            self.distance = meters
+            self.speed = meters / seconds
+            if meters > 0:
+                # A beacon that didn't move keeps its heading
+                self.heading = bearing(self.latitude, self.longitude, latitude, longitude)
+            self.travelled += meters
+        self.time = unix_time
+        self.latitude = latitude
+        self.longitude = longitude
+        self.rejected = 0
+        return True
+
+
+class MotionTable:
+    def __init__(self, max_speed=MAX_SPEED, max_rejected=MAX_REJECTED):
+        """
+        Creates a MotionTable which keeps the Motion of every beacon
+        """
+        self.max_speed = max_speed
+        self.max_rejected = max_rejected
+        self.motions = {}
+
+    def update(self, radio_id, unix_time, latitude, longitude):
+        """
+        Adds a fix from a radio
+        Returns the Motion of the radio and whether the fix was accepted
+        """
+        if (motion := self.motions.get(radio_id)) is None:
+            motion = self.motions[radio_id] = Motion()
+        accepted = motion.update(unix_time, latitude, longitude, self.max_speed, self.max_rejected)
+        return motion, accepted
+
+    def __iter__(self):
+        return iter(self.motions.values())
+
+    def __len__(self):
+        return len(self.motions)
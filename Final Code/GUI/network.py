@@ -0,0 +1,160 @@
+"""
+This file contains the code for the connections to GNU Radio. The connections
+run on an asyncio event loop in a separate thread and reconnect on their own,
+so the GUI can start before GNU Radio and keeps running if GNU Radio restarts.
+"""
+
+import asyncio
+import sys
+import threading
+import traceback
+
+BUFFER_SIZE = 2**12
+# Seconds to wait before the first reconnect, doubled after each failure
+RECONNECT_MIN_DELAY = 0.5
+# Longest time in seconds to wait between reconnects
+RECONNECT_MAX_DELAY = 10.0
+
+
+class NetworkCore:
+    def __init__(
+        self, recv_addr, send_addr, on_data, on_status=None, on_disconnect=None, loop=None
+    ):
+        """
+        Creates a NetworkCore which receives data from recv_addr and sends
+        data to send_addr, or only receives if send_addr is None
+
+        on_data is called with every chunk of received data, on_status with
+        True or False when both connections are up or one goes down, and
+        on_disconnect when the receiving connection is lost. All of them are
+        called on the event loop thread and must not block.
+
+        If loop is given the connections run on it and it has to be run by
+        the caller, so many connections can share one thread.
+        """
+        self.recv_addr = recv_addr
+        self.send_addr = send_addr
+        self.on_data = on_data
+        self.on_status = on_status
+        self.on_disconnect = on_disconnect
+        self.own_loop = loop is None
+        self.loop = asyncio.new_event_loop() if self.own_loop else loop
+        # Writer for the sending connection while it is up
+        self.writer = None
+        self.send_ready = asyncio.Event()
+        self.receiving = False
+        self.connected = False
+
+    def start(self):
+        """
+        Starts the event loop thread and connects to GNU Radio
+        """
+        if self.own_loop:
+            threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self.main(), self.loop)
+
+    async def main(self):
+        """
+        Runs both connections
+        """
+        if self.send_addr is None:
+            await self.receive()
+        else:
+            await asyncio.gather(self.receive(), self.keep_send_connection())
+
+    async def connect(self, addr):
+        """
+        Connects to addr, waiting longer after each failure
+        """
+        delay = RECONNECT_MIN_DELAY
+        while True:
+            try:
+                return await asyncio.open_connection(*addr)
+            except OSError as err:
+                # Print any connection error to the command line
+                print(
+                    f"Error connecting to {addr[0]}:{addr[1]}: {err}. Make sure GNURadio is open",
+                    file=sys.stderr,
+                )
+                print(f"Trying again in {delay} seconds")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    async def receive(self):
+        """
+        Receives data from GNU Radio and reconnects if the connection is lost
+        """
+        while True:
+            reader, writer = await self.connect(self.recv_addr)
+            self.receiving = True
+            self.update_status()
+            try:
+                # Continuously recieve data from GNURadio
+                while data := await reader.read(BUFFER_SIZE):
+                    try:
+                        self.on_data(data)
+                    except Exception as err:
+                        # Print out any error handling the data and keep
+                        # receiving, so one bad packet or callback can't stop the station
+                        print(f"Error handling data from GNURadio: {err!r}", file=sys.stderr)
+                        traceback.print_exc()
+            except OSError as err:
+                # Print out any error with receiving data
+                print(f"Error communicating with GNURadio: {err}", file=sys.stderr)
+            writer.close()
+            self.receiving = False
+            self.update_status()
+            if self.on_disconnect:
+                self.on_disconnect()
+
+    async def keep_send_connection(self):
+        """
+        Keeps the connection for sending to GNU Radio open
+        """
+        while True:
+            reader, self.writer = await self.connect(self.send_addr)
+            self.send_ready.set()
+            self.update_status()
+            try:
+                # GNU Radio never sends on this connection, so reading only
+                # returns when the connection is closed
+                await reader.read()
+            except OSError:
+                pass
+            self.send_ready.clear()
+            self.writer.close()
+            self.writer = None
+            self.update_status()
+
+    async def write(self, data):
+        """
+        Writes data once the sending connection is up
+        """
+        while True:
+            await self.send_ready.wait()
+            try:
+                self.writer.write(data)
+                await self.writer.drain()
+                return
+            except OSError as err:
+                print(f"Error sending to GNURadio: {err}", file=sys.stderr)
+                # Wait for keep_send_connection to reconnect
+                self.send_ready.clear()
+                self.writer.close()
+
+    def send(self, data):
+        """
+        Sends data to GNU Radio from another thread
+        Blocks until the data has been sent, waiting for a reconnect if needed
+        """
+        asyncio.run_coroutine_threadsafe(self.write(data), self.loop).result()
+
+    def update_status(self):
+        """
+        Calls on_status if the connections have come up or one has gone down
+        """
+        connected = self.receiving and (self.send_addr is None or self.send_ready.is_set())
+        if connected != self.connected:
+            self.connected = connected
+            if self.on_status:
+                self.on_status(connected)
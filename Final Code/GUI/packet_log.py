@@ -0,0 +1,182 @@
+"""
+This file contains the code for logging received packets without slowing
+down receiving them. Log records are put on a queue and written by a
+background thread to the console and to a rotating file with one JSON object
+per line.
+
+Routine packets are rate limited per radio and counted in a summary line
+for each radio instead, so a busy channel can't flood the log. Panic packets
+are always logged in full. The summary lines are written on a timer, so the
+last interval before the channel goes quiet is still reported.
+"""
+
+from datetime import UTC, datetime
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+# Size in bytes of the log file before it is rotated
+LOG_MAX_BYTES = 10 * 2**20
+# Number of rotated log files kept
+LOG_BACKUP_COUNT = 5
+# Routine packets logged for each radio in each summary interval
+LOG_PACKETS_PER_RADIO = 1
+# Seconds between the summary lines
+LOG_SUMMARY_INTERVAL = 10.0
+
+logger = logging.getLogger("basestation")
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a log record as one line of JSON, with the fields of its data
+    """
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, UTC).isoformat(),
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "data", {}))
+        return json.dumps(entry)
+
+
+def setup_logging(path, console=True, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT):
+    """
+    Logs to a rotating JSON lines file at path, and to the console if console
+    is True, from a background thread
+    Records still waiting are written when the program exits
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    file_handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+    )
+    file_handler.setFormatter(JsonFormatter())
+    handlers = [file_handler]
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter("%(message)s"))
+        handlers.append(console_handler)
+    # Logging only puts the record on the queue, the handlers run on the listener thread
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    listener = logging.handlers.QueueListener(log_queue, *handlers)
+    listener.start()
+    atexit.register(listener.stop)
+
+
+def packet_data(packet, event):
+    """
+    Returns the fields of a Packet written to the log file
+    """
+    return {
+        "event": event,
+        "radio_id": packet.radio_id,
+        "message_id": packet.message_id,
+        "panic_state": packet.panic_state,
+        "latitude": packet.latitude,
+        "longitude": packet.longitude,
+        "battery_life": packet.battery_life,
+        "unix_time": packet.unix_time,
+    }
+
+
+class PacketLogger:
+    def __init__(
+        self, per_radio=LOG_PACKETS_PER_RADIO, summary_interval=LOG_SUMMARY_INTERVAL
+    ):
+        """
+        Creates a PacketLogger which logs at most per_radio routine packets
+        from each radio in every summary_interval seconds, then a summary line
+        for each radio
+        """
+        self.per_radio = per_radio
+        self.summary_interval = summary_interval
+        # Packets received from each radio in this interval
+        self.counts = {}
+        # Time the interval started, which is when the first packet arrives
+        self.interval_start = None
+        # Packets are logged on the network thread and summarized on the timer thread
+        self.lock = threading.Lock()
+
+    def start(self):
+        """
+        Logs the summary lines every summary_interval seconds on a separate
+        thread, even when no more packets arrive
+        """
+        threading.Thread(target=self.exec, daemon=True).start()
+
+    def exec(self):
+        """
+        Main exec loop for the summary timer
+        Runs in a separate thread
+        """
+        while True:
+            time.sleep(self.summary_interval)
+            now = time.monotonic()
+            with self.lock:
+                # Nothing to summarize before the first packet
+                if self.interval_start is None:
+                    continue
+                if now - self.interval_start >= self.summary_interval:
+                    self.summarize(now)
+
+    def log_packet(self, packet, now=None):
+        """
+        Logs a decoded Packet
+        Can be called from any thread
+        """
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            if self.interval_start is None:
+                self.interval_start = now
+            elif now - self.interval_start >= self.summary_interval:
+                self.summarize(now)
+            count = self.counts.get(packet.radio_id, 0) + 1
+            self.counts[packet.radio_id] = count
+        if packet.panic_state:
+            # Panic packets are never rate limited
+            logger.warning(
+                "\nPANIC Packet Received:\n%s",
+                packet.log_text(),
+                extra={"data": packet_data(packet, "panic")},
+            )
+        elif count <= self.per_radio:
+            logger.info(
+                "Radio %d: message %d at %.4f, %.4f, battery %d%%",
+                packet.radio_id,
+                packet.message_id,
+                packet.latitude,
+                packet.longitude,
+                packet.battery_life,
+                extra={"data": packet_data(packet, "packet")},
+            )
+
+    def summarize(self, now):
+        """
+        Logs how many packets each radio sent in the interval that just ended
+        Must be called with the lock held
+        """
+        seconds = now - self.interval_start
+        for radio_id, count in self.counts.items():
+            if count > self.per_radio:
+                logger.info(
+                    "Radio %d: %d fixes in the last %.0f s",
+                    radio_id,
+                    count,
+                    seconds,
+                    extra={
+                        "data": {"event": "summary", "radio_id": radio_id, "count": count, "seconds": seconds}
+                    },
+                )
+        self.counts.clear()
+        self.interval_start = now
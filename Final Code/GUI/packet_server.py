@@ -0,0 +1,119 @@
+"""
+This file contains the code for sending received packets to any number of
+subscribers over TCP. Packets are sent in the same frames as GNU Radio sends
+them, so a subscriber can read them exactly like it reads from GNU Radio.
+"""
+
+import asyncio
+from collections import deque
+import sys
+
+from codec import PANIC_BIT
+from framing import HEADER_SIZE
+from metrics import metrics
+
+# Most routine packets that can wait for a subscriber before the oldest are
+# dropped (panic packets are never dropped)
+SUBSCRIBER_QUEUE_SIZE = 1024
+# Header put in front of each packet, since the one from GNU Radio is not kept
+FRAME_HEADER = bytes(HEADER_SIZE)
+
+
+class Subscriber:
+    """
+    Connection to one subscriber and the packets waiting to be sent to it
+    Panic packets wait in their own lane which is sent first and never dropped
+    """
+
+    __slots__ = ("writer", "max_queue", "panic", "routine", "ready", "dropped")
+
+    def __init__(self, writer, max_queue):
+        self.writer = writer
+        self.max_queue = max_queue
+        self.panic = deque()
+        self.routine = deque()
+        # Set while packets are waiting
+        self.ready = asyncio.Event()
+        # Number of packets dropped because the subscriber was too slow
+        self.dropped = 0
+
+    def put(self, frame, panic):
+        """
+        Queues a frame, dropping the oldest routine frame if the routine lane is full
+        """
+        if panic:
+            self.panic.append(frame)
+        else:
+            if len(self.routine) >= self.max_queue:
+                # Drop the oldest packet so the subscriber gets the newest ones
+                self.routine.popleft()
+                self.dropped += 1
+                metrics.count("subscriber_dropped")
+            self.routine.append(frame)
+        self.ready.set()
+
+    def take(self):
+        """
+        Returns every waiting frame, panic frames first
+        """
+        frames = [*self.panic, *self.routine]
+        self.panic.clear()
+        self.routine.clear()
+        self.ready.clear()
+        return frames
+
+
+class PacketServer:
+    def __init__(self, loop, host, port, max_queue=SUBSCRIBER_QUEUE_SIZE):
+        """
+        Creates a PacketServer which accepts subscribers on host:port using the
+        event loop loop
+
+        Each subscriber has its own queue of max_queue routine packets so a
+        slow one can't hold up the others
+        """
+        self.loop = loop
+        self.host = host
+        self.port = port
+        self.max_queue = max_queue
+        self.subscribers = set()
+
+    def start(self):
+        """
+        Starts accepting subscribers
+        """
+        asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(self.serve, self.host, self.port), self.loop
+        ).result()
+
+    def publish(self, packet, point=None):
+        """
+        Queues a packet for every subscriber
+        Must be called on the event loop thread
+        """
+        # Copy the bytes since the packet buffer can be reused
+        frame = FRAME_HEADER + bytes(packet)
+        panic = bool(packet[2] & PANIC_BIT)
+        for subscriber in self.subscribers:
+            subscriber.put(frame, panic)
+
+    async def serve(self, reader, writer):
+        """
+        Sends packets to a subscriber until it disconnects
+        """
+        subscriber = Subscriber(writer, self.max_queue)
+        self.subscribers.add(subscriber)
+        peer = writer.get_extra_info("peername")
+        print(f"Subscriber connected: {peer}")
+        try:
+            while True:
+                # Wait for a packet, then send everything that is waiting at once
+                await subscriber.ready.wait()
+                writer.write(b"".join(subscriber.take()))
+                await writer.drain()
+        except OSError as err:
+            print(f"Error sending to subscriber {peer}: {err}", file=sys.stderr)
+        finally:
+            self.subscribers.discard(subscriber)
+            writer.close()
+            print(f"Subscriber disconnected: {peer} ({subscriber.dropped} packets dropped)")
@@ -0,0 +1,167 @@
+"""
+This file contains the code for saving received packets to an SQLite database
+so they are kept after the GUI is closed. Packets are written in batches on a
+separate thread so receiving packets never waits on the disk.
+"""
+
+from contextlib import closing
+import sqlite3
+import sys
+import threading
+import time
+
+from codec import decode
+from lanes import LaneQueue
+
+# Most routine packets that can wait to be written before the oldest are
+# dropped (panic packets are never dropped)
+STORE_QUEUE_SIZE = 10000
+# Most packets written in one transaction
+STORE_BATCH_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    started_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS packets (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL,
+    received_at REAL NOT NULL,
+    radio_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    panic_state INTEGER NOT NULL,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL,
+    battery_life INTEGER NOT NULL,
+    unix_time INTEGER NOT NULL,
+    payload BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS packets_radio_time ON packets (radio_id, unix_time);
+CREATE INDEX IF NOT EXISTS packets_time ON packets (unix_time);
+CREATE INDEX IF NOT EXISTS packets_session ON packets (session_id);
+CREATE INDEX IF NOT EXISTS packets_session_radio_time ON packets (session_id, radio_id, unix_time);
+"""
+
+
+def connect(path):
+    """
+    Opens a connection to the database
+    """
+    connection = sqlite3.connect(path)
+    # Write ahead logging lets the GUI read while packets are being written
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+class PacketStore:
+    def __init__(self, path, max_queue=STORE_QUEUE_SIZE, batch_size=STORE_BATCH_SIZE):
+        """
+        Creates a PacketStore which saves packets to the database at path
+        Each PacketStore starts a new session in the database
+        """
+        self.path = path
+        self.batch_size = batch_size
+        with closing(connect(path)) as connection, connection:
+            connection.executescript(SCHEMA)
+            self.session_id = connection.execute(
+                "INSERT INTO sessions (started_at) VALUES (?)", (time.time(),)
+            ).lastrowid
+        # Packets waiting to be written with the time they were received,
+        # panic packets first
+        self.queue = LaneQueue(max_queue)
+        # Number of packets dropped because the queue was full
+        self.dropped = 0
+        # Starts a separate thread that writes the packets
+        threading.Thread(target=self.exec, daemon=True).start()
+
+    def append(self, packet):
+        """
+        Queues a 16 byte packet to be saved without blocking
+        """
+        # Copy the bytes since the packet buffer can be reused
+        if not self.queue.put((bytes(packet), time.time()), panic=packet[2] & 0b10000000):
+            # The oldest routine packet was dropped to make room
+            self.dropped += 1
+
+    def exec(self):
+        """
+        Main exec loop for the writer
+        Runs in a separate thread
+        """
+        # SQLite connections can only be used on the thread that made them
+        connection = connect(self.path)
+        try:
+            while True:
+                # Wait for a packet, then write everything that is waiting at once
+                batch = self.queue.get_batch(self.batch_size)
+                rows = []
+                for payload, received_at in batch:
+                    packet = decode(payload)
+                    rows.append(
+                        (
+                            self.session_id,
+                            received_at,
+                            packet.radio_id,
+                            packet.message_id,
+                            packet.panic_state,
+                            packet.latitude,
+                            packet.longitude,
+                            packet.battery_life,
+                            packet.unix_time,
+                            payload,
+                        )
+                    )
+                with connection:
+                    connection.executemany(
+                        "INSERT INTO packets (session_id, received_at, radio_id, message_id,"
+                        " panic_state, latitude, longitude, battery_life, unix_time, payload)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        rows,
+                    )
+        except sqlite3.Error as err:
+            # Print out any error with writing packets
+            print(f"Error saving packets: {err}", file=sys.stderr)
+        finally:
+            connection.close()
+
+    def last_session(self, per_radio=None):
+        """
+        Returns the payloads of the packets from the session before this one,
+        oldest first, keeping only the newest per_radio packets of each radio
+        unless it is None
+        """
+        with closing(connect(self.path)) as connection:
+            (session_id,) = connection.execute(
+                "SELECT MAX(session_id) FROM packets WHERE session_id < ?", (self.session_id,)
+            ).fetchone()
+            if per_radio is None:
+                rows = connection.execute(
+                    "SELECT payload FROM packets WHERE session_id = ? ORDER BY id", (session_id,)
+                ).fetchall()
+            else:
+                # Take the newest packets of each radio from the index, so
+                # the older packets are never read
+                rows = connection.execute(
+                    "SELECT packets.payload FROM"
+                    " (SELECT DISTINCT radio_id FROM packets WHERE session_id = ?1) AS radios"
+                    " JOIN packets ON packets.id IN ("
+                    "  SELECT id FROM packets WHERE session_id = ?1 AND radio_id = radios.radio_id"
+                    "  ORDER BY unix_time DESC, id DESC LIMIT ?2"
+                    " ) ORDER BY packets.id",
+                    (session_id, per_radio),
+                ).fetchall()
+        return [payload for (payload,) in rows]
+
+    def fixes(self, radio_id, start, end):
+        """
+        Returns the (unix_time, latitude, longitude) of every packet from a
+        radio with a unix time from start to end, oldest first
+        """
+        with closing(connect(self.path)) as connection:
+            return connection.execute(
+                "SELECT unix_time, latitude, longitude FROM packets"
+                " WHERE radio_id = ? AND unix_time BETWEEN ? AND ? ORDER BY unix_time",
+                (radio_id, start, end),
+            ).fetchall()
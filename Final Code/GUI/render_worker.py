@@ -0,0 +1,266 @@
+"""
+This file contains the code for building map updates away from the threads
+that receive and acknowledge packets. The state of the map lives in a worker,
+by default a separate process so building the map never holds the GIL the
+network thread needs. The GUI sends it the new points and gets back the
+JavaScript or html to show.
+
+Only the newest state of the map is worth showing, so points that arrive
+while the worker is busy are merged into one job instead of each being
+rendered in turn.
+
+If the worker process dies a new one is started and the map is drawn again
+from the recent points of each radio, which the GUI keeps for this.
+"""
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import sys
+import threading
+import time
+
+from bounds import BoundsTracker
+import live_map
+from motion import MotionTable
+from tracks import TRACK_HISTORY_SIZE, TrackStore
+
+# Most points that can wait for the running job before only the newest point
+# of each radio is kept (panic points are never dropped)
+RENDER_MAX_PENDING = 2000
+
+
+class MapState:
+    def __init__(self, incremental=True, cluster=True, tiles=None, fit_bounds_window=None):
+        """
+        Creates a MapState which keeps the tracks shown on the map and builds
+        the updates for the GUI
+
+        If incremental is True the updates are scripts for the live map,
+        otherwise they are the html of the whole map.
+        """
+        self.incremental = incremental
+        self.cluster = cluster
+        self.tiles = tiles
+        # Keeps the map bounds up to date as points are added
+        self.boundsTracker = BoundsTracker(fit_bounds_window)
+        # Bounds last sent to the live map, which are only sent again once the
+        # points grow past them so the map isn't moved on every update
+        self.sent_bounds = None
+        # Keeps the latest position and recent history of each radio
+        self.trackStore = TrackStore()
+        # Works out how each radio is moving and rejects GPS glitches
+        self.motionTable = MotionTable()
+
+    def add(self, point, now):
+        """
+        Adds a decoded Packet received at the monotonic time now to the track of its radio
+        Returns a (radio_id, latitude, longitude, packet, added, panic_state)
+        tuple where added is True if the point was added to the history of the
+        track, or None if the radio has no good position yet
+        """
+        motion, accepted = self.motionTable.update(
+            point.radio_id, point.unix_time, point.latitude, point.longitude
+        )
+        if accepted:
+            latitude, longitude = point.latitude, point.longitude
+            # Grow the map bounds with the point
+            self.boundsTracker.add(point.radio_id, latitude, longitude, now)
+        elif motion.time is None:
+            return None
+        else:
+            # Keep the marker at the last good position, the popup and panic
+            # state still come from the new packet
+            latitude, longitude = motion.latitude, motion.longitude
+        # Move the marker for the radio and add the point to its history
+        # The popup is only formatted from the packet when the marker is drawn
+        _, added = self.trackStore.add(
+            point.radio_id, latitude, longitude, point, point.panic_state, now
+        )
+        return point.radio_id, latitude, longitude, point, added, point.panic_state
+
+    def render(self, delta, full=False):
+        """
+        Adds a list of (time, point) tuples to the map
+        Returns a ("script" or "html", payload, seconds taken) tuple, where the
+        script only holds the changed tracks unless full is True
+        """
+        start = time.perf_counter()
+        updates = [update for now, point in delta if (update := self.add(point, now))]
+        # Adjust map bounds so all points can be seen
+        if bounds := self.boundsTracker.window_bounds():
+            grown = self.sent_bounds is None or not self.sent_bounds.contains(bounds)
+            if grown or full or not self.incremental:
+                self.sent_bounds = bounds.copy()
+                bounds = bounds.padded(live_map.BOUNDS_PADDING)
+            else:
+                bounds = None
+        if self.incremental:
+            if full:
+                # Draw every track from its history rather than every point
+                updates = live_map.track_updates(self.trackStore)
+            result = "script", live_map.update_tracks_script(updates, bounds, full)
+        else:
+            # folium is only imported when the whole map is built in Python
+            import map_render
+
+            # Rebuild the map from the tracks so old markers are not kept
+            map = map_render.tracks_map(self.trackStore, bounds, self.cluster, self.tiles)
+            result = "html", map_render.map_html(map)
+        return (*result, time.perf_counter() - start)
+
+
+# State of the map in the worker
+state = None
+
+
+def init_state(*settings):
+    """
+    Creates the state of the map when the worker starts
+    """
+    global state
+    state = MapState(*settings)
+
+
+def render(delta, full):
+    """
+    Renders a job in the worker
+    """
+    return state.render(delta, full)
+
+
+class RenderWorker:
+    def __init__(self, on_result, settings=(), in_process=True, max_pending=RENDER_MAX_PENDING):
+        """
+        Creates a RenderWorker which keeps a MapState created with settings and
+        calls on_result with the result of each render on a worker thread
+
+        The MapState is kept in a separate process if in_process is True,
+        otherwise on a separate thread. Once max_pending points are waiting
+        for the running job only the newest routine point of each radio is kept.
+        """
+        self.on_result = on_result
+        self.max_pending = max_pending
+        self.settings = settings
+        self.in_process = in_process
+        self.executor = self.new_executor()
+        self.lock = threading.Lock()
+        # Newest points of each radio, to draw the map again if the process dies
+        self.recent = {}
+        # Set while a job is being rendered
+        self.running = False
+        # Points waiting for the running job to finish, and whether they need a full render
+        self.pending = []
+        self.pending_full = False
+        # Number of waiting points that causes them to be compacted, which
+        # grows if most of them are from different radios
+        self.compact_at = max_pending
+        # Number of jobs merged into a later one, and of waiting points dropped
+        self.coalesced = 0
+        self.dropped = 0
+        # Number of times the worker process was started again
+        self.restarts = 0
+
+    def new_executor(self):
+        """
+        Returns a new executor whose worker has an empty MapState
+        """
+        if self.in_process:
+            # Spawn rather than fork a copy of this process with its Qt and
+            # network threads. main.py only imports the GUI when it is run, so
+            # the worker doesn't load it either.
+            return ProcessPoolExecutor(
+                1,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_state,
+                initargs=self.settings,
+            )
+        return ThreadPoolExecutor(1, initializer=init_state, initargs=self.settings)
+
+    def submit(self, delta, full=False):
+        """
+        Renders a list of (time, point) tuples, or merges them into the next job
+        if the worker is busy so only the newest state is rendered
+        """
+        with self.lock:
+            if self.in_process:
+                for item in delta:
+                    radio_id = item[1].radio_id
+                    if (points := self.recent.get(radio_id)) is None:
+                        points = self.recent[radio_id] = deque(maxlen=TRACK_HISTORY_SIZE)
+                    points.append(item)
+            if self.running:
+                if self.pending or self.pending_full:
+                    self.coalesced += 1
+                self.pending += delta
+                self.pending_full |= full
+                if len(self.pending) > self.compact_at:
+                    self.compact()
+                return
+            self.running = True
+        self.start(delta, full)
+
+    def start(self, delta, full):
+        """
+        Sends a job to the worker
+        """
+        try:
+            future = self.executor.submit(render, delta, full)
+        except BrokenProcessPool as err:
+            self.restart(err)
+            return
+        future.add_done_callback(self.done)
+
+    def done(self, future):
+        """
+        Passes on the result of a job and starts the next one
+        """
+        try:
+            self.on_result(*future.result())
+        except BrokenProcessPool as err:
+            self.restart(err)
+            return
+        except Exception as err:
+            # Print out any error with rendering, the next job may still work
+            print(f"Error rendering the map: {err!r}", file=sys.stderr)
+        with self.lock:
+            delta, full = self.pending, self.pending_full
+            self.pending, self.pending_full = [], False
+            self.compact_at = self.max_pending
+            if not delta and not full:
+                self.running = False
+                return
+        self.start(delta, full)
+
+    def restart(self, err):
+        """
+        Starts a new worker process after the old one died, then draws the
+        whole map again from the recent points of each radio
+        """
+        print(f"Error rendering the map, restarting the render process: {err!r}", file=sys.stderr)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = self.new_executor()
+        self.restarts += 1
+        with self.lock:
+            # The recent points include every pending point
+            delta = [item for points in self.recent.values() for item in points]
+            self.pending, self.pending_full = [], False
+            self.compact_at = self.max_pending
+        self.start(delta, True)
+
+    def compact(self):
+        """
+        Drops the waiting points that are not the newest of their radio,
+        keeping panic points and the order of the rest
+        Must be called with the lock held
+        """
+        newest = {point.radio_id: index for index, (_, point) in enumerate(self.pending)}
+        kept = [
+            item
+            for index, item in enumerate(self.pending)
+            if item[1].panic_state or newest[item[1].radio_id] == index
+        ]
+        self.dropped += len(self.pending) - len(kept)
+        self.pending = kept
+        self.compact_at = max(self.max_pending, 2 * len(kept))
@@ -0,0 +1,80 @@
+"""
+This file contains the code for limiting how often the map in the GUI is
+updated. Points are collected as they are received and handed to the map in
+batches so the amount of rendering depends on the refresh rate instead of the
+packet rate.
+"""
+
+import threading
+import time
+
+from lanes import LaneQueue
+from metrics import metrics
+
+
+# Most routine points that can wait before they are coalesced or dropped
+MAX_PENDING = 5000
+
+
+class UpdateScheduler:
+    def __init__(self, flush, max_rate, max_batch, max_pending=MAX_PENDING, coalesce_key=None):
+        """
+        Creates an UpdateScheduler which calls flush with a list of points
+        at most max_rate times per second, or sooner if max_batch points are
+        waiting or an urgent point is submitted
+
+        Once max_pending routine points are waiting, a new point replaces the
+        waiting point with the same coalesce_key(point), or the oldest one.
+        Urgent points are never dropped and are flushed first.
+        """
+        self.flush = flush
+        # Minimum time in seconds between flushes
+        self.interval = 1 / max_rate
+        self.max_batch = max_batch
+        # Points waiting to be flushed
+        self.queue = LaneQueue(max_pending, coalesce_key, notify_at=max_batch)
+        # Time the oldest waiting point was submitted, for measuring how long points wait
+        self.oldest = 0.0
+        metrics.gauge("scheduler_queue_depth", lambda: len(self.queue))
+        metrics.gauge("scheduler_dropped", lambda: self.queue.dropped)
+        metrics.gauge("scheduler_coalesced", lambda: self.queue.coalesced)
+        # Starts a separate thread that flushes the points
+        threading.Thread(target=self.exec, daemon=True).start()
+
+    def submit(self, point, urgent=False):
+        """
+        Adds a point to the next batch
+        Urgent points are flushed right away
+        """
+        with self.queue.condition:
+            if not self.queue:
+                self.oldest = metrics.now()
+            # Wakes up the flush thread if it should not wait for the interval
+            self.queue.put(point, panic=urgent)
+
+    def ready(self):
+        """
+        Returns True if the waiting points should be flushed without waiting for the interval
+        """
+        return self.queue.panic_waiting() or len(self.queue) >= self.max_batch
+
+    def exec(self):
+        """
+        Main exec loop for the scheduler
+        Runs in a separate thread
+        """
+        last_flush = float("-inf")
+        while True:
+            with self.queue.condition:
+                # Wait until there is something to flush
+                self.queue.condition.wait_for(self.queue.__len__)
+                # Wait for the rest of the interval unless the batch can't wait
+                self.queue.wait(self.ready, last_flush + self.interval - time.monotonic())
+                # Take every waiting point as one batch, urgent points first
+                batch = self.queue.take()
+                metrics.observe("queue_wait", self.oldest)
+            last_flush = time.monotonic()
+            # Flush outside the lock so points can keep being submitted
+            start = metrics.now()
+            self.flush(batch)
+            metrics.observe("flush", start)
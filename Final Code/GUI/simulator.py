@@ -0,0 +1,451 @@
+"""
+This file contains a discrete-event simulator of the radio network: the PLBs,
+the Range Extender and the base station sharing one LoRa channel. It follows
+the timing of PLB.ino and Range_Extender.ino and the radio settings in
+basestation.grc, so the size of a deployment can be tried out before it is
+built.
+
+Every transmission on the channel is heard by every radio, so two
+transmissions that overlap in time are both lost.
+
+Run this file to simulate a deployment, see --help. With --capture the frames
+the base station receives are recorded to a capture file, which can be shown
+in the GUI with REPLAY_PATH in gui.py or sent to it with
+gnu_radio_emulator.py --replay.
+"""
+
+import argparse
+import heapq
+import itertools
+import math
+import random
+import time
+
+from capture import CaptureWriter
+from codec import FRAME_STRUCT, PANIC_BIT
+from framing import FRAME_SIZE
+
+# Time in seconds between PLB transmissions and how much it varies either way (PLB.ino)
+SLEEP_TIME = 10.0
+SLEEP_TIME_VARIANCE = 2.0
+# Time in seconds between Range Extender transmissions (SEND_INTERVAL in Range_Extender.ino)
+SEND_INTERVAL = 1.0
+# LoRa settings of basestation.grc, RadioHead uses the same by default
+SPREADING_FACTOR = 7
+BANDWIDTH = 125000
+# Coding rate 4/(4 + CODING_RATE)
+CODING_RATE = 1
+PREAMBLE_LENGTH = 8
+HAS_CRC = True
+IMPLICIT_HEADER = False
+# The acknowledgement is the radio id and message byte of the packet
+ACK_SIZE = 3
+# Seconds from the end of a packet until the base station starts sending its acknowledgement
+ACK_LATENCY = 0.05
+# Fraction of the PLBs close enough for the base station to hear them without the Range Extender
+DIRECT_FRACTION = 0.5
+# Panic button presses per PLB per hour and seconds the button is held
+PANIC_RATE = 0.1
+PANIC_DURATION = 60.0
+# Where the simulated beacons are
+START_LATITUDE = 37.227779
+START_LONGITUDE = -80.422289
+
+# Kinds of event
+WAKE, PANIC, RELEASE, TRANSMITTED, EXTENDER_SEND, ACK_SEND = range(6)
+
+
+def airtime(
+    payload_size,
+    spreading_factor=SPREADING_FACTOR,
+    bandwidth=BANDWIDTH,
+    coding_rate=CODING_RATE,
+    preamble_length=PREAMBLE_LENGTH,
+    has_crc=HAS_CRC,
+    implicit_header=IMPLICIT_HEADER,
+):
+    """
+    Returns the seconds a LoRa packet with payload_size bytes is on the air
+    From the Semtech SX1276 datasheet
+    """
+    symbol_time = 2**spreading_factor / bandwidth
+    # Low data rate optimization is turned on for symbols longer than 16 ms
+    low_data_rate = symbol_time > 0.016
+    payload_symbols = 8 + max(
+        math.ceil(
+            (8 * payload_size - 4 * spreading_factor + 28 + 16 * has_crc - 20 * implicit_header)
+            / (4 * (spreading_factor - 2 * low_data_rate))
+        )
+        * (coding_rate + 4),
+        0,
+    )
+    return (preamble_length + 4.25 + payload_symbols) * symbol_time
+
+
+class Beacon:
+    """
+    A simulated PLB
+    """
+
+    __slots__ = ("radio_id", "message_id", "panic_state", "direct", "latitude", "longitude")
+
+    def __init__(self, radio_id, direct):
+        self.radio_id = radio_id
+        self.message_id = 0
+        self.panic_state = False
+        # Whether the base station can hear the beacon without the Range Extender
+        self.direct = direct
+        self.latitude = START_LATITUDE + random.uniform(-0.05, 0.05)
+        self.longitude = START_LONGITUDE + random.uniform(-0.05, 0.05)
+
+
+class Frame:
+    """
+    A packet sent by a PLB, which the Range Extender may send again
+    """
+
+    __slots__ = ("beacon", "message_id", "panic_state", "sent_at", "delivered")
+
+    def __init__(self, beacon, sent_at):
+        self.beacon = beacon
+        self.message_id = beacon.message_id
+        self.panic_state = beacon.panic_state
+        self.sent_at = sent_at
+        self.delivered = False
+
+
+class Transmission:
+    """
+    A frame or acknowledgement on the air
+    """
+
+    __slots__ = ("sender", "frame", "collided")
+
+    def __init__(self, sender, frame):
+        # "plb", "extender" or "base"
+        self.sender = sender
+        self.frame = frame
+        self.collided = False
+
+
+class Simulator:
+    def __init__(
+        self,
+        beacons,
+        extender=True,
+        extender_sends=1,
+        direct_fraction=DIRECT_FRACTION,
+        ack_latency=ACK_LATENCY,
+        panic_rate=PANIC_RATE,
+        panic_duration=PANIC_DURATION,
+        capture_path=None,
+        seed=None,
+    ):
+        """
+        Creates a Simulator of beacons PLBs, a Range Extender if extender is
+        True, and the base station
+
+        The Range Extender sends each packet it keeps extender_sends times, one
+        every SEND_INTERVAL, unless it hears the acknowledgement first.
+        Range_Extender.ino sends it once.
+        """
+        random.seed(seed)
+        self.beacons = [
+            Beacon(radio_id, random.random() < direct_fraction) for radio_id in range(1, beacons + 1)
+        ]
+        self.extender = extender
+        self.extender_sends = extender_sends
+        self.ack_latency = ack_latency
+        self.panic_rate = panic_rate / 3600
+        self.panic_duration = panic_duration
+        self.frame_airtime = airtime(FRAME_SIZE)
+        self.ack_airtime = airtime(ACK_SIZE)
+        self.capture = CaptureWriter(capture_path) if capture_path else None
+        self.start_time = time.time()
+        self.events = []
+        # Breaks ties between events at the same time in the order they were scheduled
+        self.sequence = itertools.count()
+        self.now = 0.0
+        # End of the latest transmission, and the transmission on the air that has not collided yet
+        self.busy_until = 0.0
+        self.clear = None
+        # Frame kept by the Range Extender, sends left, and whether a send is scheduled
+        self.extender_frame = None
+        self.extender_left = 0
+        self.extender_next = 0.0
+        self.extender_scheduled = False
+        # Counters
+        self.counts = dict.fromkeys(
+            (
+                "events",
+                "sent",
+                "panic_sent",
+                "delivered",
+                "panic_delivered",
+                "received",
+                "duplicates",
+                "collided",
+                "relayed",
+                "overwritten",
+                "cancelled",
+                "acks",
+            ),
+            0,
+        )
+        # Seconds anything was on the air
+        self.busy_time = 0.0
+        # Seconds from sending a packet until the base station first received it
+        self.latencies = []
+
+    def schedule(self, when, kind, item):
+        """
+        Adds an event at the virtual time when
+        """
+        heapq.heappush(self.events, (when, next(self.sequence), kind, item))
+
+    def run(self, duration):
+        """
+        Simulates duration seconds of virtual time
+        """
+        for beacon in self.beacons:
+            # The beacons are turned on at random times in the first sleep
+            self.schedule(random.uniform(0, SLEEP_TIME), WAKE, beacon)
+            if self.panic_rate:
+                self.schedule(random.expovariate(self.panic_rate), PANIC, beacon)
+        events = self.events
+        pop = heapq.heappop
+        frame_airtime = self.frame_airtime
+        count = 0
+        while events and events[0][0] < duration:
+            self.now, _, kind, item = pop(events)
+            count += 1
+            if kind == TRANSMITTED:
+                self.transmitted(item)
+            elif kind == WAKE:
+                # Send, then sleep a random time like PLB.ino
+                self.transmit(Transmission("plb", self.next_frame(item)), frame_airtime)
+                self.schedule(
+                    self.now + SLEEP_TIME + SLEEP_TIME_VARIANCE * (2 * random.random() - 1), WAKE, item
+                )
+            elif kind == ACK_SEND:
+                self.counts["acks"] += 1
+                self.transmit(Transmission("base", item), self.ack_airtime)
+            elif kind == EXTENDER_SEND:
+                self.extender_send()
+            elif kind == PANIC:
+                # Pressing the panic button sends right away, without waiting for the sleep to end
+                item.panic_state = True
+                self.transmit(Transmission("plb", self.next_frame(item)), frame_airtime)
+                self.schedule(self.now + self.panic_duration, RELEASE, item)
+            elif kind == RELEASE:
+                item.panic_state = False
+                self.schedule(self.now + random.expovariate(self.panic_rate), PANIC, item)
+        self.counts["events"] += count
+        self.now = duration
+        if self.capture:
+            self.capture.close()
+
+    def next_frame(self, beacon):
+        """
+        Returns the next packet of a beacon
+        """
+        frame = Frame(beacon, self.now)
+        # Increment without using the panic bit, like PLB.ino
+        beacon.message_id = (beacon.message_id + 1) & 0b1111111
+        self.counts["sent"] += 1
+        if frame.panic_state:
+            self.counts["panic_sent"] += 1
+        return frame
+
+    def transmit(self, transmission, seconds):
+        """
+        Puts a transmission on the air for seconds and marks the
+        transmissions it overlaps as collided
+        """
+        now = self.now
+        end = now + seconds
+        if now < self.busy_until:
+            # Something is still on the air, both are lost
+            transmission.collided = True
+            if self.clear is not None:
+                self.clear.collided = True
+                self.clear = None
+            if end > self.busy_until:
+                self.busy_time += end - self.busy_until
+                self.busy_until = end
+        else:
+            self.clear = transmission
+            self.busy_time += seconds
+            self.busy_until = end
+        heapq.heappush(self.events, (end, next(self.sequence), TRANSMITTED, transmission))
+
+    def transmitted(self, transmission):
+        """
+        Delivers a transmission that has ended to the radios that can hear it
+        """
+        if self.clear is transmission:
+            self.clear = None
+        if transmission.collided:
+            self.counts["collided"] += 1
+            return
+        frame = transmission.frame
+        if transmission.sender == "plb":
+            if self.extender:
+                self.extender_receive(frame)
+            if frame.beacon.direct:
+                self.base_receive(frame)
+        elif transmission.sender == "extender":
+            self.base_receive(frame)
+        elif self.extender_frame is not None:
+            # The Range Extender doesn't need to send a packet that was acknowledged
+            kept = self.extender_frame
+            if kept.beacon is frame.beacon and kept.message_id == frame.message_id:
+                self.extender_frame = None
+                self.counts["cancelled"] += 1
+
+    def extender_receive(self, frame):
+        """
+        Keeps a frame in the single slot of the Range Extender until its next send
+        """
+        if self.extender_frame is not None:
+            # The packet that was kept is never sent
+            self.counts["overwritten"] += 1
+        self.extender_frame = frame
+        self.extender_left = self.extender_sends
+        if not self.extender_scheduled:
+            # The Range Extender checks for a packet to send every SEND_INTERVAL
+            if self.extender_next <= self.now:
+                self.extender_next += math.ceil((self.now - self.extender_next) / SEND_INTERVAL) * SEND_INTERVAL
+                if self.extender_next <= self.now:
+                    self.extender_next += SEND_INTERVAL
+            self.extender_scheduled = True
+            self.schedule(self.extender_next, EXTENDER_SEND, None)
+
+    def extender_send(self):
+        """
+        Sends the frame kept by the Range Extender
+        """
+        self.extender_scheduled = False
+        frame = self.extender_frame
+        if frame is None:
+            self.extender_next = self.now + SEND_INTERVAL
+            return
+        self.counts["relayed"] += 1
+        self.transmit(Transmission("extender", frame), self.frame_airtime)
+        self.extender_left -= 1
+        if self.extender_left <= 0:
+            self.extender_frame = None
+        # The Range Extender waits for the packet to be sent before it starts the next interval
+        self.extender_next = self.now + self.frame_airtime + SEND_INTERVAL
+        if self.extender_frame is not None:
+            self.extender_scheduled = True
+            self.schedule(self.extender_next, EXTENDER_SEND, None)
+
+    def base_receive(self, frame):
+        """
+        Receives a frame at the base station, which acknowledges every copy
+        """
+        self.counts["received"] += 1
+        if frame.delivered:
+            self.counts["duplicates"] += 1
+        else:
+            frame.delivered = True
+            self.counts["delivered"] += 1
+            self.counts["panic_delivered"] += frame.panic_state
+            self.latencies.append(self.now - frame.sent_at)
+        self.schedule(self.now + self.ack_latency, ACK_SEND, frame)
+        if self.capture:
+            beacon = frame.beacon
+            self.capture.write(
+                FRAME_STRUCT.pack(
+                    beacon.radio_id,
+                    frame.message_id | (PANIC_BIT if frame.panic_state else 0),
+                    beacon.latitude,
+                    beacon.longitude,
+                    100,
+                    int(self.start_time + frame.sent_at),
+                ),
+                self.now,
+            )
+
+    def report(self):
+        """
+        Returns the results as lines of text
+        """
+        counts = self.counts
+        duration = self.now or 1
+        # Seconds on the air by sender
+        plb = counts["sent"] * self.frame_airtime
+        extender = counts["relayed"] * self.frame_airtime
+        base = counts["acks"] * self.ack_airtime
+        transmissions = counts["sent"] + counts["relayed"] + counts["acks"]
+        latencies = sorted(self.latencies)
+
+        def percentile(fraction):
+            if not latencies:
+                return math.nan
+            return latencies[min(int(fraction * len(latencies)), len(latencies) - 1)] * 1000
+
+        return [
+            f"Beacons: {len(self.beacons)} for {duration:.0f} s",
+            f"Airtime: packet {self.frame_airtime * 1000:.1f} ms, acknowledgement {self.ack_airtime * 1000:.1f} ms",
+            f"Channel busy: {self.busy_time / duration:.1%}"
+            f" (offered load {(plb + extender + base) / duration:.2f} Erlang:"
+            f" PLB {plb / duration:.2f},"
+            f" Range Extender {extender / duration:.2f},"
+            f" acknowledgements {base / duration:.2f})",
+            f"Collided: {counts['collided']} of {transmissions} transmissions"
+            f" ({counts['collided'] / max(transmissions, 1):.1%})",
+            f"Delivered: {counts['delivered']} of {counts['sent']} packets"
+            f" ({counts['delivered'] / max(counts['sent'], 1):.1%}),"
+            f" panic {counts['panic_delivered']} of {counts['panic_sent']}"
+            f" ({counts['panic_delivered'] / max(counts['panic_sent'], 1):.1%})",
+            f"Duplicates: {counts['duplicates']} of {counts['received']} received"
+            f" ({counts['duplicates'] / max(counts['received'], 1):.1%},"
+            f" {counts['duplicates'] / duration:.2f}/s)",
+            f"Range Extender: {counts['relayed']} sent, {counts['overwritten']} overwritten"
+            f" before being sent, {counts['cancelled']} cancelled by an acknowledgement",
+            f"Latency ms: p50={percentile(0.5):.0f} p95={percentile(0.95):.0f} p99={percentile(0.99):.0f}",
+        ]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--beacons", type=int, default=100, help="number of PLBs")
+    parser.add_argument("--duration", type=float, default=3600.0, help="seconds of virtual time")
+    parser.add_argument("--no-extender", action="store_true", help="simulate without a Range Extender")
+    parser.add_argument(
+        "--extender-sends", type=int, default=1,
+        help="times the Range Extender sends each packet unless it hears the acknowledgement",
+    )
+    parser.add_argument(
+        "--direct", type=float, default=DIRECT_FRACTION,
+        help="fraction of PLBs the base station hears without the Range Extender",
+    )
+    parser.add_argument(
+        "--ack-latency", type=float, default=ACK_LATENCY,
+        help="seconds the base station takes to start sending an acknowledgement",
+    )
+    parser.add_argument("--panic-rate", type=float, default=PANIC_RATE, help="panic presses per PLB per hour")
+    parser.add_argument("--capture", metavar="FILE", help="record the frames the base station receives")
+    parser.add_argument("--seed", type=int, help="seed for the random numbers")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    simulator = Simulator(
+        args.beacons,
+        extender=not args.no_extender,
+        extender_sends=args.extender_sends,
+        direct_fraction=args.direct,
+        ack_latency=args.ack_latency,
+        panic_rate=args.panic_rate,
+        capture_path=args.capture,
+        seed=args.seed,
+    )
+    start = time.perf_counter()
+    simulator.run(args.duration)
+    seconds = time.perf_counter() - start
+    print("\n".join(simulator.report()))
+    print(f"Simulated {simulator.counts['events']} events in {seconds:.2f} s")
@@ -0,0 +1,148 @@
+"""
+This file contains the code for receiving packets from GNU Radio, decoding
+them and sending acknowledgements. It does not use Qt so it can be used by the
+GUI and by the headless daemon.
+"""
+
+import sys
+
+from ack_sender import AckSender
+from beacons import BeaconTable
+from capture import CaptureWriter, ReplaySource
+from codec import PacketLengthError, decode
+from dedup import DuplicateIndex
+from framing import FrameDecoder
+from metrics import metrics
+from network import NetworkCore
+from packet_store import PacketStore
+
+
+class BaseStation:
+    def __init__(
+        self,
+        recv_addr,
+        send_addr=None,
+        store_path=None,
+        on_status=None,
+        capture_path=None,
+        replay_path=None,
+        replay_speed=1.0,
+    ):
+        """
+        Creates a BaseStation which receives packets from recv_addr
+
+        Acknowledgements are sent to send_addr and packets are saved to the
+        database at store_path unless they are None. on_status is called with
+        True or False when the connection to GNU Radio comes up or goes down.
+
+        The raw data from GNU Radio is recorded to capture_path if it is given.
+        If replay_path is given, the capture file at that path is played at
+        replay_speed times the recorded speed (0 for as fast as possible)
+        instead of connecting to GNU Radio, and no acknowledgements are sent.
+        """
+        # Splits the byte stream from GNURadio into packets
+        self.frameDecoder = FrameDecoder()
+        # Records the byte stream so it can be played back later
+        self.capture = CaptureWriter(capture_path) if capture_path else None
+        if replay_path:
+            # Plays a recorded byte stream in place of GNURadio
+            self.network = ReplaySource(
+                replay_path,
+                on_data=self.receive,
+                on_status=on_status,
+                on_disconnect=self.disconnected,
+                speed=replay_speed,
+            )
+            send_addr = None
+        else:
+            # Connects to GNURadio and reconnects if the connection is lost
+            self.network = NetworkCore(
+                recv_addr,
+                send_addr,
+                on_data=self.receive,
+                on_status=on_status,
+                on_disconnect=self.disconnected,
+            )
+        # Sends acknowledgements on its own thread so receiving never waits on them
+        self.ackSender = AckSender(self.network.send) if send_addr else None
+        # Recognizes packets that were already received from the PLB or Range Extender
+        self.duplicateIndex = DuplicateIndex()
+        # Saves every packet so it is kept after the program is closed
+        self.packetStore = PacketStore(store_path) if store_path else None
+        # Keeps the state of every beacon and notices when one stops reporting
+        self.beaconTable = BeaconTable()
+        # Functions called with every new packet
+        self.subscribers = []
+        # Report how far behind each thread is
+        if self.ackSender:
+            metrics.gauge("ack_queue_depth", lambda: len(self.ackSender.queue))
+            metrics.gauge("ack_dropped", lambda: self.ackSender.dropped)
+        if self.packetStore:
+            metrics.gauge("store_queue_depth", lambda: len(self.packetStore.queue))
+            metrics.gauge("store_dropped", lambda: self.packetStore.dropped)
+        metrics.gauge("beacons", lambda: len(self.beaconTable))
+        metrics.gauge("beacons_stale", lambda: self.beaconTable.count("stale"))
+        metrics.gauge("beacons_lost", lambda: self.beaconTable.count("lost"))
+
+    def subscribe(self, callback):
+        """
+        Calls callback with the packet bytes and the decoded Packet of every new
+        packet. It is called on the network thread so it must not block, and
+        the packet bytes are only valid until it returns.
+        """
+        self.subscribers.append(callback)
+
+    def start(self):
+        """
+        Starts receiving from GNURadio on a separate thread
+        """
+        self.network.start()
+        # The beacon table is only used on the network thread
+        self.network.loop.call_soon_threadsafe(self.beaconTable.run, self.network.loop)
+
+    def disconnected(self):
+        """
+        Forgets any partial packet when the connection to GNURadio is lost
+        """
+        self.frameDecoder.reset()
+        if self.capture:
+            self.capture.disconnected()
+
+    def receive(self, data):
+        """
+        Handles data received from GNURadio
+        Runs on the network thread so it must not block
+        """
+        received = metrics.now()
+        if self.capture:
+            self.capture.write(data)
+        # One recv can hold several packets or only part of one
+        for packet in self.frameDecoder.frames(data):
+            metrics.count("packets")
+            try:
+                # Decode the point
+                start = metrics.now()
+                point = decode(packet)
+                metrics.observe("decode", start)
+                # Send an acknoledgement back to GNURadio
+                if self.ackSender:
+                    self.ackSender.send(packet[:3])
+                # Drop copies relayed by the Range Extender
+                start = metrics.now()
+                duplicate = self.duplicateIndex.seen(packet)
+                metrics.observe("dedup", start)
+                if duplicate:
+                    metrics.count("duplicates")
+                    continue
+                # Save the packet
+                if self.packetStore:
+                    self.packetStore.append(packet)
+                self.beaconTable.update(point)
+                for callback in self.subscribers:
+                    callback(packet, point)
+            except PacketLengthError as err:
+                metrics.count("length_errors")
+                # Print out any error with packet length
+                print(f"Error: {err}", file=sys.stderr)
+                # Continue receiving packets
+        metrics.observe("recv", received)
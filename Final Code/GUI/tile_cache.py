@@ -0,0 +1,398 @@
+"""
+This file contains the code for keeping map tiles on disk so the map works
+without an internet connection. Tiles are stored in an MBTiles file (an SQLite
+database that other map tools can open) and served to the map by a small HTTP
+server. Tiles that are not in the cache are downloaded while online and the
+least recently used tiles are removed once the cache is full.
+
+The map page also loads Leaflet and its plugins from the internet, so the
+server caches those files too and offline_html points the page at them. Only
+the files offline_html rewrote, and the files their stylesheets refer to, are
+fetched, so the server can't be used to download anything else. They count
+towards the size of the cache like the tiles.
+
+Run this file to download the tiles for an area before going into the field,
+see --help.
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import math
+import re
+import sqlite3
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+# Where tiles are downloaded from when they are not cached
+TILE_URL = "https://tile.openstreetmap.org/{z}/{x}/{y}.png"
+TILE_ATTRIBUTION = '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors'
+# OpenStreetMap asks every application to identify itself
+USER_AGENT = "PLB-base-station-tile-cache/1.0"
+# Largest size of the cached tiles in bytes before the least recently used are removed
+TILE_CACHE_MAX_SIZE = 500 * 2**20
+# Fraction of the largest size the cache is brought down to when it is full
+TILE_CACHE_LOW_WATER = 0.9
+# Tile accesses remembered before their times are written to the database
+TILE_TOUCH_BATCH = 64
+# Seconds to wait for a download before showing the map without the tile
+DOWNLOAD_TIMEOUT = 5.0
+# Seconds downloads are not tried after one fails to connect, so the map stays fast offline
+OFFLINE_RETRY_DELAY = 30.0
+# Downloads run at once while seeding (OpenStreetMap asks for no more than 2)
+SEED_WORKERS = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS tiles (
+    zoom_level INTEGER NOT NULL,
+    tile_column INTEGER NOT NULL,
+    tile_row INTEGER NOT NULL,
+    tile_data BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (zoom_level, tile_column, tile_row)
+);
+CREATE INDEX IF NOT EXISTS tiles_last_used ON tiles (last_used);
+CREATE TABLE IF NOT EXISTS assets (
+    url TEXT PRIMARY KEY,
+    content_type TEXT NOT NULL,
+    data BLOB NOT NULL
+);
+"""
+
+# Address of the files a page loads from the internet
+ASSET_URL = re.compile(r'((?:src|href)=["\'])(https?)://([^"\']*)')
+# Address of a file a stylesheet loads, such as a font
+CSS_URL = re.compile(r'url\(\s*["\']?([^"\')]+?)["\']?\s*\)')
+
+
+def connect(path):
+    """
+    Opens a connection to the database
+    """
+    # The server handles each request on its own thread
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+def tile_range(south, west, north, east, zoom):
+    """
+    Returns the x and y ranges of the tiles covering a bounding box at a zoom level
+    """
+    def tile(latitude, longitude):
+        # Web Mercator projection used by the OpenStreetMap tiles
+        n = 2**zoom
+        latitude = math.radians(max(min(latitude, 85.0511), -85.0511))
+        x = int((longitude + 180) / 360 * n)
+        y = int((1 - math.asinh(math.tan(latitude)) / math.pi) / 2 * n)
+        return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+    west_x, north_y = tile(north, west)
+    east_x, south_y = tile(south, east)
+    return range(west_x, east_x + 1), range(north_y, south_y + 1)
+
+
+def download(url):
+    """
+    Downloads url and returns its content type and data
+    """
+    request = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
+    with urllib.request.urlopen(request, timeout=DOWNLOAD_TIMEOUT) as response:
+        return response.headers.get_content_type(), response.read()
+
+
+class TileCache:
+    def __init__(self, path, max_size=TILE_CACHE_MAX_SIZE, tile_url=TILE_URL, online=True):
+        """
+        Creates a TileCache which keeps tiles in the MBTiles file at path
+
+        Missing tiles are downloaded from tile_url unless online is False, and
+        the least recently used tiles are removed once they take up more than
+        max_size bytes.
+        """
+        self.max_size = max_size
+        self.tile_url = tile_url
+        self.online = online
+        # Time downloads can be tried again after one failed
+        self.retry_at = 0.0
+        self.connection = connect(path)
+        # One connection is shared by every thread
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.executescript(SCHEMA)
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO metadata (name, value) VALUES (?, ?)",
+                [("name", "Base station tiles"), ("format", "png"), ("type", "baselayer")],
+            )
+            # The files the map page loads count towards the size as well
+            (self.size,) = self.connection.execute(
+                "SELECT (SELECT COALESCE(SUM(size), 0) FROM tiles)"
+                " + (SELECT COALESCE(SUM(LENGTH(data)), 0) FROM assets)"
+            ).fetchone()
+        # Urls of the files the map page is allowed to load through the server
+        self.allowed_assets = set()
+        # Time each tile was last used that has not been written yet
+        self.touched = {}
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def tile(self, z, x, y):
+        """
+        Returns the png data of a tile, or None if it is not cached and can't
+        be downloaded
+        """
+        # MBTiles numbers rows from the bottom of the map
+        key = (z, x, 2**z - 1 - y)
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                key,
+            ).fetchone()
+            if row:
+                self.hits += 1
+                self.touched[key] = time.time()
+                if len(self.touched) >= TILE_TOUCH_BATCH:
+                    self.write_touched()
+                return row[0]
+        self.misses += 1
+        # Download outside the lock so cached tiles are served in the meantime
+        if (result := self.download(self.tile_url.format(z=z, x=x, y=y))) is None:
+            return None
+        _, data = result
+        self.add(key, data)
+        return data
+
+    def download(self, url):
+        """
+        Downloads url and returns its content type and data, or None if there
+        is no connection or the server doesn't have it
+        """
+        if not self.online or time.monotonic() < self.retry_at:
+            return None
+        try:
+            return download(url)
+        except urllib.error.HTTPError as err:
+            # The server answered, so only this file is missing
+            print(f"Error downloading {url}: {err}", file=sys.stderr)
+            return None
+        except (OSError, urllib.error.URLError) as err:
+            print(f"Error downloading {url}: {err}", file=sys.stderr)
+            self.retry_at = time.monotonic() + OFFLINE_RETRY_DELAY
+            return None
+
+    def add(self, key, data):
+        """
+        Saves a tile and removes the least recently used tiles if the cache is full
+        """
+        with self.lock, self.connection:
+            replaced = self.connection.execute(
+                "SELECT size FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                key,
+            ).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?, ?)",
+                (*key, data, len(data), time.time()),
+            )
+            self.size += len(data) - (replaced[0] if replaced else 0)
+            if self.size > self.max_size:
+                self.evict()
+
+    def write_touched(self):
+        """
+        Writes the times tiles were last used
+        Must be called with the lock held
+        """
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE tiles SET last_used = ? WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                [(used, *key) for key, used in self.touched.items()],
+            )
+        self.touched.clear()
+
+    def evict(self):
+        """
+        Removes the least recently used tiles until the cache is below the low water mark
+        The files the map page loads are kept, since the map can't work without them
+        Must be called with the lock held
+        """
+        self.write_touched()
+        target = self.size - self.max_size * TILE_CACHE_LOW_WATER
+        freed = 0
+        rowids = []
+        for rowid, size in self.connection.execute(
+            "SELECT rowid, size FROM tiles ORDER BY last_used"
+        ):
+            if freed >= target:
+                break
+            rowids.append((rowid,))
+            freed += size
+        self.connection.executemany("DELETE FROM tiles WHERE rowid = ?", rowids)
+        self.size -= freed
+        self.evicted += len(rowids)
+
+    def asset(self, url):
+        """
+        Returns the content type and data of a file the map page loads, or None
+        if the page doesn't load it, or it is not cached and can't be downloaded
+        """
+        with self.lock:
+            if url not in self.allowed_assets:
+                return None
+            row = self.connection.execute(
+                "SELECT content_type, data FROM assets WHERE url = ?", (url,)
+            ).fetchone()
+        if row:
+            content_type, data = row
+        elif (result := self.download(url)) is None:
+            return None
+        else:
+            content_type, data = result
+            with self.lock, self.connection:
+                replaced = self.connection.execute(
+                    "SELECT LENGTH(data) FROM assets WHERE url = ?", (url,)
+                ).fetchone()
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO assets VALUES (?, ?, ?)", (url, content_type, data)
+                )
+                self.size += len(data) - (replaced[0] if replaced else 0)
+                if self.size > self.max_size:
+                    self.evict()
+        if content_type == "text/css":
+            # Allow the fonts and images the stylesheet loads, which are
+            # relative to it so they are fetched through the server as well
+            text = data.decode("utf-8", "replace")
+            with self.lock:
+                self.allowed_assets.update(
+                    urllib.parse.urljoin(url, match)
+                    for match in CSS_URL.findall(text)
+                    if not match.startswith("data:")
+                )
+        return content_type, data
+
+    def offline_html(self, html, addr):
+        """
+        Returns html with the files it loads from the internet loaded through
+        the tile server on addr instead, so the page works offline once they
+        are cached
+        Only the files rewritten here can be loaded through the server
+        """
+        urls = set()
+
+        def rewrite(match):
+            urls.add(f"{match[2]}://{match[3]}")
+            return f"{match[1]}{server_url(addr)}/assets/{match[2]}/{match[3]}"
+
+        html = ASSET_URL.sub(rewrite, html)
+        with self.lock:
+            self.allowed_assets |= urls
+        return html
+
+    def seed(self, south, west, north, east, min_zoom, max_zoom):
+        """
+        Downloads every tile covering a bounding box from min_zoom to max_zoom
+        that is not cached yet
+        """
+        missing = []
+        with self.lock:
+            for z in range(min_zoom, max_zoom + 1):
+                xs, ys = tile_range(south, west, north, east, z)
+                cached = set(
+                    self.connection.execute(
+                        "SELECT tile_column, tile_row FROM tiles WHERE zoom_level = ?", (z,)
+                    )
+                )
+                missing += [
+                    (z, x, y) for x in xs for y in ys if (x, 2**z - 1 - y) not in cached
+                ]
+        print(f"Downloading {len(missing)} tiles")
+        with ThreadPoolExecutor(SEED_WORKERS) as executor:
+            for count, _ in enumerate(executor.map(lambda tile: self.tile(*tile), missing), 1):
+                if count % 100 == 0:
+                    print(f"{count}/{len(missing)} tiles, cache is {self.size / 2**20:.1f} MB")
+
+    def serve(self, addr):
+        """
+        Serves tiles at http://host:port/{z}/{x}/{y}.png and the files the
+        map page loads at http://host:port/assets/... on a separate thread
+        If the port is already used, for example by another GUI on the same
+        computer, a free port is used instead, so use server_address of the
+        returned server
+        """
+        cache = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith("/assets/"):
+                    # The original url is kept in the path so relative urls
+                    # inside the files, such as fonts in CSS, still work
+                    scheme, _, rest = self.path[len("/assets/") :].partition("/")
+                    result = cache.asset(f"{scheme}://{rest}")
+                elif match := re.fullmatch(r"/(\d+)/(\d+)/(\d+)\.png", self.path):
+                    data = cache.tile(*map(int, match.groups()))
+                    result = ("image/png", data) if data else None
+                else:
+                    result = None
+                if result is None:
+                    self.send_error(404)
+                    return
+                content_type, data = result
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                # Cached files never change, so the browser can keep them too
+                self.send_header("Cache-Control", "max-age=86400")
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                # Don't print every request to the console
+                pass
+
+        try:
+            server = ThreadingHTTPServer(addr, Handler)
+        except OSError as err:
+            print(f"Error serving tiles on {server_url(addr)}: {err}, using a free port", file=sys.stderr)
+            server = ThreadingHTTPServer((addr[0], 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def server_url(addr):
+    """
+    Returns the url of a tile server running on addr
+    """
+    return f"http://{addr[0]}:{addr[1]}"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Download map tiles for offline use")
+    parser.add_argument("file", help="MBTiles file to save the tiles to")
+    parser.add_argument(
+        "--bounds", type=float, nargs=4, metavar=("SOUTH", "WEST", "NORTH", "EAST"), required=True
+    )
+    parser.add_argument("--zoom", type=int, nargs=2, metavar=("MIN", "MAX"), default=(10, 16))
+    parser.add_argument(
+        "--max-size", type=float, default=TILE_CACHE_MAX_SIZE / 2**20, help="cache size in MB"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    cache = TileCache(args.file, max_size=args.max_size * 2**20)
+    cache.seed(*args.bounds, *args.zoom)
+    with cache.lock:
+        cache.write_touched()
+    print(f"Done, cache is {cache.size / 2**20:.1f} MB")
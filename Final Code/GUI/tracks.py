@@ -0,0 +1,120 @@
+"""
+This file contains the code for keeping a track of the recent positions of
+each PLB. Only a fixed number of positions are kept for each radio so memory
+depends on the number of beacons instead of the number of packets.
+"""
+
+from collections import deque
+import math
+import time
+
+# Most positions kept in the history of each radio
+TRACK_HISTORY_SIZE = 100
+# A new position is kept if it is at least this many meters from the last one
+TRACK_MIN_DISTANCE = 10.0
+# or at least this many seconds after the last one
+TRACK_MIN_INTERVAL = 60.0
+
+# Mean radius of the earth in meters
+EARTH_RADIUS = 6371008.8
+
+
+def distance(latitude1, longitude1, latitude2, longitude2):
+    """
+    Returns the distance in meters between two points using the haversine formula
+    """
+    phi1 = math.radians(latitude1)
+    phi2 = math.radians(latitude2)
+    delta_phi = phi2 - phi1
+    delta_lambda = math.radians(longitude2 - longitude1)
+    a = (
+        math.sin(delta_phi / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+class Fix:
+    """
+    Position of a radio at one time
+    """
+
+    __slots__ = ("time", "latitude", "longitude")
+
+    def __init__(self, time, latitude, longitude):
+        self.time = time
+        self.latitude = latitude
+        self.longitude = longitude
+
+
+class Track:
+    """
+    Latest point from a radio and a history of its recent positions
+    """
+
+    __slots__ = ("radio_id", "latest", "popup", "panic_state", "history")
+
+    def __init__(self, radio_id, history_size):
+        self.radio_id = radio_id
+        # Latest position, which is shown as the marker
+        self.latest = None
+        # Latest Packet, shown in the popup for the marker
+        self.popup = None
+        # Panic state of the latest packet
+        self.panic_state = False
+        # Recent positions, oldest first, which are shown as a line
+        self.history = deque(maxlen=history_size)
+
+    def add(self, fix, popup, panic_state, min_distance, min_interval):
+        """
+        Moves the track to a new position
+        Returns True if the position was added to the history
+        """
+        self.latest = fix
+        self.popup = popup
+        self.panic_state = panic_state
+        if self.history:
+            last = self.history[-1]
+            # Skip positions that are too close in both time and distance to the last one
+            if (
+                fix.time - last.time < min_interval
+                and distance(last.latitude, last.longitude, fix.latitude, fix.longitude)
+                < min_distance
+            ):
+                return False
+        # The oldest position is dropped when the history is full
+        self.history.append(fix)
+        return True
+
+
+class TrackStore:
+    def __init__(
+        self,
+        history_size=TRACK_HISTORY_SIZE,
+        min_distance=TRACK_MIN_DISTANCE,
+        min_interval=TRACK_MIN_INTERVAL,
+    ):
+        """
+        Creates a TrackStore which keeps one track for each radio
+        """
+        self.history_size = history_size
+        self.min_distance = min_distance
+        self.min_interval = min_interval
+        self.tracks = {}
+
+    def add(self, radio_id, latitude, longitude, popup, panic_state=False, now=None):
+        """
+        Adds a position to the track of a radio
+        Returns the track and whether the position was added to its history
+        """
+        if (track := self.tracks.get(radio_id)) is None:
+            track = self.tracks[radio_id] = Track(radio_id, self.history_size)
+        fix = Fix(time.monotonic() if now is None else now, latitude, longitude)
+        added = track.add(fix, popup, panic_state, self.min_distance, self.min_interval)
+        return track, added
+
+    def __iter__(self):
+        return iter(self.tracks.values())
+
+    def __len__(self):
+        return len(self.tracks)